@@ -2,13 +2,23 @@ import sys
 import os
 import time
 import threading
+import atexit
+import copy
+import collections
 from functools import partial
 import math
 import obd
 from datetime import datetime
+from datalog import LogWriter, BinaryLogWriter, CSV_HEADER
+from journal import TripJournal, Checkpoint
+from history import TimeSeriesStore
+from diagnostics import instruments
+from profiler import SamplingProfiler
+from acquisition import AcquisitionProcess
+from vehicles import VehicleProfiles, Profile, fingerprint
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QWidget, QApplication, QDialog
-from PyQt5.QtGui import QBrush, QPen, QPainter, QPalette, QIcon
+from PyQt5.QtGui import QBrush, QPen, QPainter, QPalette, QIcon, QPixmap
 from PyQt5.QtCore import Qt, QThread
 
 #Fonts
@@ -30,64 +40,847 @@ big_font.setStyleStrategy(QtGui.QFont.PreferDefault)
 directory = os.path.realpath(__file__).split(os.path.basename(__file__))
 filepath = directory[0]
 
+# the hub only holds what python-obd decodes (degC, km/h, rpm, g/s), these convert it for the screen and the
+# log. key = metric setting, value = {quantity: (scale, offset)}
+UNITS = {
+    True: {"temp": (1.0, 0.0), "speed": (1.0, 0.0), "distance": (1.0, 0.0), "volume": (1.0, 0.0)},
+    False: {"temp": (1.8, 32.0), "speed": (0.621371, 0.0), "distance": (0.621371, 0.0),
+            "volume": (1 / 3.78541, 0.0)}}
+
+def convert(metric, quantity, value):
+    scale, offset = UNITS[metric][quantity]
+    return value * scale + offset
+
+class TelemetryHub(object):
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.temp, self.speed, self.rpm = 0.0, 0.0, 0.0
+        self.maf, self.eqr = 1.0, 1.0 #initialize as 1 to avoid dividing by zero
+        self.num_of_mafs = 1 #keeps track of how many MAF sensor readings have occured
+                             #this is used for calculating the simple moving average for MPG
+        self.sequence = 0 #bumped on every pushed sample so waiting threads can tell new data from a timeout
+        self.stamps = {} #key = sample name, value = time.monotonic() of its latest push
+        self.pushed = 0.0 #time.monotonic() of the latest push of any sample
+        self.history = TimeSeriesStore(("temp", "speed", "rpm", "maf", "eqr")) #raw values, for graphs
+
+    def push(self, name, value, stamp=None):
+        # stamp is when the sample arrived if the connection knows better than now, e.g. AcquisitionProcess
+        with self.condition:
+            setattr(self, name, value)
+            self.stamps[name] = time.monotonic() if stamp is None else stamp
+            self.history.add(name, self.stamps[name], value)
+            instruments.sampled(name, self.stamps[name])
+            self.pushed = self.stamps[name]
+            if name == "maf":
+                self.num_of_mafs += 1
+            self.sequence += 1
+            self.condition.notify_all()
+
+    def latest(self):
+        with self.condition:
+            return self.sequence, (self.temp, self.speed, self.rpm, self.eqr, self.maf, self.num_of_mafs)
+
+    def wait(self, sequence, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != sequence, timeout)
+        return self.latest()
+
+hub = TelemetryHub()
+connection = None #PIDScheduler, ReplayConnection or AcquisitionProcess, None until VehicleConnector has connected
+
 class OBDThread(QThread):
     signal = QtCore.pyqtSignal(float, float, float, float, float, int)
-    temp, speed, rpm = 0.0, 0.0, 0.0
-    maf, eqr = 1.0, 1.0 #initialize as 1 to avoid dividing by zero
-    num_of_mafs = 1 #keeps track of how many MAF sensor readings have occured
-                    #this is used for calculating the simple moving average for MPG
 
-    def __init__(self):
+    def __init__(self, name="display"):
         super(OBDThread, self).__init__()
-        self.sleepinterval = 0.015
+        self.sleepinterval = 0.015 #minimum time between emits, caps the redraw rate during bursts
+        self.name = name #prefix of its diagnostics stages and counters
+        self.emitted = 0.0 #when the latest sample was emitted
 
     def run(self):
+        threading.current_thread().name = "OBDThread " + self.name #for the profiler reports
+        sequence, last = -1, None
+        lastemit = 0.0
         while threading.main_thread().is_alive():
-            self.signal.emit(self.temp,self.speed,self.rpm,self.eqr, self.maf, self.num_of_mafs)
-            time.sleep(self.sleepinterval)
+            sequence, sample = hub.wait(sequence, 0.5) #the timeout only exists to notice the main thread exiting
+            if sample == last:
+                continue
+            holdoff = lastemit + self.sleepinterval - time.monotonic()
+            if holdoff > 0:
+                time.sleep(holdoff) #callbacks arriving meanwhile are coalesced into a single emit
+                emitted, sample = hub.latest()
+                instruments.count(self.name + " coalesced samples", emitted - sequence)
+                sequence = emitted
+            self.emitted = time.monotonic()
+            if hub.pushed > 0:
+                instruments.record(self.name + " push to emit", self.emitted - hub.pushed)
+            self.signal.emit(*sample)
+            last = sample
+            lastemit = time.monotonic()
 
     def setIntervalTime(self, sleeptime):
         self.sleepinterval = sleeptime
 
 def new_temp(t):
-    if mw.metric is False:
-        t1 = t.value.to('degF')
-        OBDThread.temp = t1.magnitude
-    else:
-        OBDThread.temp = t.value.magnitude
+    hub.push("temp", t.value.magnitude, getattr(t, "stamp", None))
 
 def new_speed(s):
-    if mw.metric is False:
-        s1 = s.value.to('mph')
-        OBDThread.speed = s1.magnitude
-    else:
-        OBDThread.speed = s.value.magnitude
+    hub.push("speed", s.value.magnitude, getattr(s, "stamp", None))
 
 def new_rpm(r):
-    OBDThread.rpm = r.value.magnitude
+    hub.push("rpm", r.value.magnitude, getattr(r, "stamp", None))
 
 def new_maf(m):
-    OBDThread.maf = m.value.magnitude
-    OBDThread.num_of_mafs += 1
+    hub.push("maf", m.value.magnitude, getattr(m, "stamp", None))
 
 def new_eqr(e):
-    OBDThread.eqr = e.value.magnitude
+    hub.push("eqr", e.value.magnitude, getattr(e, "stamp", None))
+
+class PIDSchedule(object):
+    def __init__(self, command, rate, priority, force, due=0.0):
+        self.command = command
+        self.callbacks = []
+        self.rate = rate #target samples per second
+        self.priority = priority #higher priorities keep their rate when the bus is saturated
+        self.force = force
+        self.interval = 1.0 / rate #interval actually granted by PIDScheduler.allocateRates
+        self.paused = False #set by PIDScheduler.throttle for commands that aren't needed at the moment
+        self.due = due
+        self.lastpoll = None #when the command was last asked for
+        self.retry = 0.0 #after a NO DATA or CAN ERROR reply, when the command is asked again
+        self.failures = 0 #null replies in a row
+        self.errors = 0 #null replies in total
+        self.response = obd.OBDResponse()
+
+    def dueAt(self):
+        return max(self.due, self.retry)
+
+class PIDScheduler(obd.OBD):
+    # drop-in replacement for obd.Async that polls each watched command at its own rate instead of
+    # sweeping every command back to back, and shares the measured bus time out by priority
+    minshare = 0.1 #fraction of its target rate a command keeps however busy the bus is
+    headroom = 0.9 #fraction of the measured bus capacity the scheduler plans to use
+    batchsize = 6 #most PIDs a single Mode 01 request may carry
+
+    def __init__(self, portstr=None, baudrate=None, protocol=None, fast=True, timeout=0.1,
+                 check_voltage=True, start_low_power=False, batched=False, profiles=None):
+        self.profiles = profiles #VehicleProfiles the supported PIDs are looked up in, None always probes
+        self.profile = None #how this vehicle was reached, once connected
+        self.batched = batched #group due Mode 01 commands into multi-PID requests
+        self.batchfailures = 0
+        self.batchframes = {} #key = request string, value = number of frames the ECU answered with
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.schedules = {} #key = OBDCommand, value = PIDSchedule
+        self.roundtrip = 0.1 #seconds per sample, exponential moving average of what the adapter delivers
+        self.latency = 0.05 #seconds from a sample being read by the ECU to its callback, half a request's round trip
+        self.allocated = 0.0 #when the rates were last fitted to the measured round trip
+        self.ratescale = 1.0 #fraction of the target rates polled, below 1 spare bus time is left unused
+        super(PIDScheduler, self).__init__(portstr, baudrate, protocol, fast, timeout, check_voltage,
+                                           start_low_power)
+
+    def start(self):
+        if not self.is_connected() or len(self.schedules) == 0 or self.thread is not None:
+            return
+        self.allocateRates()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="PIDScheduler")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.running = False
+            if self.thread is not threading.current_thread():
+                self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self.stop()
+        super(PIDScheduler, self).close()
+
+    def _OBD__load_commands(self):
+        # overrides python-obd's private probe of the supported PIDs (name mangled, OBD.__init__ calls it
+        # through this name). a car whose protocol and PIDS_A answer match a cached profile takes the other
+        # bitmaps from the cache instead of a request per PID getter
+        if self.status() != obd.OBDStatus.CAR_CONNECTED:
+            return
+        r = obd.OBD.query(self, obd.commands.PIDS_A)
+        if r.is_null():
+            return
+        pidsa = int(str(r.value), 2)
+        cached = None
+        if self.profiles is not None:
+            cached = self.profiles.get(fingerprint(self.protocol_id(), pidsa))
+        bitmaps = dict(cached.bitmaps) if cached is not None else {"PIDS_A": pidsa}
+        for getter in obd.commands.pid_getters(): #in order, each getter is supported by the bits before it
+            if getter.name not in bitmaps:
+                if cached is not None or not self.test_cmd(getter, warn=False):
+                    continue
+                r = obd.OBD.query(self, getter)
+                if r.is_null() or len(r.value) == 0:
+                    continue
+                bitmaps[getter.name] = int(str(r.value)[:32].ljust(32, "0"), 2)
+            for i in range(32):
+                if bitmaps[getter.name] >> (31 - i) & 1:
+                    pid = getter.pid + i + 1
+                    if obd.commands.has_pid(getter.mode, pid):
+                        self.supported_commands.add(obd.commands[getter.mode][pid])
+                    if getter.mode == 1 and obd.commands.has_pid(2, pid):
+                        self.supported_commands.add(obd.commands[2][pid])
+        port = getattr(self.interface, "_ELM327__port", None)
+        self.profile = Profile(fingerprint(self.protocol_id(), pidsa), self.port_name(),
+                               port.baudrate if port is not None else 0, self.protocol_id(), bitmaps)
+
+    def watch(self, c, callback=None, force=False, rate=1.0, priority=0):
+        if not force and not self.test_cmd(c):
+            return
+        with self.lock:
+            if c not in self.schedules:
+                # staggered by a golden ratio fraction of the interval, so commands watched together don't
+                # all come due on the same pass
+                stagger = (len(self.schedules) * 0.618 % 1.0) / rate
+                self.schedules[c] = PIDSchedule(c, rate, priority, force, due=time.monotonic() + stagger)
+            if callback is not None and callback not in self.schedules[c].callbacks:
+                self.schedules[c].callbacks.append(callback)
+            self.allocateRates()
+
+    def unwatch(self, c, callback=None):
+        with self.lock:
+            if c in self.schedules:
+                if callback in self.schedules[c].callbacks:
+                    self.schedules[c].callbacks.remove(callback)
+                if callback is None or len(self.schedules[c].callbacks) == 0:
+                    self.schedules.pop(c)
+            self.allocateRates()
+
+    def unwatch_all(self):
+        with self.lock:
+            self.schedules = {}
+
+    def query(self, c, force=False):
+        if c in self.schedules:
+            return self.schedules[c].response
+        return obd.OBDResponse()
+
+    def throttle(self, scale, priority=0):
+        # polls every command at scale times its rate and pauses the ones below priority. allocateRates pulls
+        # every due time back to the last poll plus the new interval, so going back to full rate takes effect
+        # from the next sample instead of after the deadlines of the throttled rate
+        with self.lock:
+            self.ratescale = scale
+            for sch in self.schedules.values():
+                sch.paused = sch.priority < priority
+            self.allocateRates()
+
+    def allocateRates(self):
+        # when the bus can't carry every target rate, each command is slowed down in proportion to
+        # 2**-priority, so every priority level halves how much of its rate it gives up; whatever
+        # capacity is left once every target is met goes to the highest priority commands
+        scheds = [sch for sch in self.schedules.values() if not sch.paused]
+        if len(scheds) == 0:
+            return
+        capacity = self.headroom / max(self.roundtrip, 0.001)
+        def granted(k):
+            return [sch.rate * self.ratescale * max(min(1.0, k * 2 ** sch.priority), self.minshare)
+                    for sch in scheds]
+        low, high = 0.0, 1.0
+        if sum(granted(high)) > capacity:
+            for i in range(30):
+                if sum(granted((low + high) / 2)) > capacity:
+                    high = (low + high) / 2
+                else:
+                    low = (low + high) / 2
+        rates = granted(low if high < 1.0 else high)
+        spare = capacity - sum(rates)
+        top = max(sch.priority for sch in scheds)
+        wanted = sum(sch.rate for sch in scheds if sch.priority == top)
+        for i, sch in enumerate(scheds):
+            if spare > 0 and sch.priority == top and self.ratescale >= 1.0:
+                rates[i] += spare * sch.rate / wanted
+            sch.interval = 1.0 / rates[i]
+            if sch.lastpoll is not None:
+                # due was pushed out by the previous interval, a faster rate takes effect from the last poll
+                sch.due = min(sch.due, sch.lastpoll + sch.interval)
+
+    def nextSchedule(self):
+        with self.lock:
+            scheds = [sch for sch in self.schedules.values() if not sch.paused]
+            if len(scheds) == 0:
+                return None
+            return min(scheds, key=lambda sch: (sch.dueAt(), -sch.priority))
+
+    def batchFor(self, sch):
+        # the due command plus any other Mode 01 command that would come due within half its interval,
+        # fetching those a little early costs nothing once they share a round trip
+        batch = [sch]
+        if not self.batched or sch.command.mode != 1:
+            return batch
+        now = time.monotonic()
+        with self.lock:
+            others = sorted((o for o in self.schedules.values() if o is not sch and o.command.mode == 1
+                             and not o.paused and o.retry <= now and o.due - o.interval / 2 <= now),
+                            key=lambda o: (o.due, -o.priority))
+        return batch + others[:self.batchsize - 1]
+
+    def queryBatch(self, batch):
+        request = b"01" + b"".join(("%02X" % sch.command.pid).encode() for sch in batch)
+        cmd_string = request
+        if self.fast and request in self.batchframes:
+            cmd_string += str(self.batchframes[request]).encode() #the ELM stops waiting after that many frames
+        messages = self.interface.send_and_parse(cmd_string) or []
+        # obd.OBD remembers its last command and sends an empty line to repeat it,
+        # which would now repeat this request instead
+        self._OBD__last_command = b""
+        frames = sum(len(m.frames) for m in messages)
+        if frames > 0:
+            self.batchframes.setdefault(request, frames) #keyed by the request without the frame count
+        bypid = dict((sch.command.pid, sch) for sch in batch)
+        responses = {}
+        for m in messages:
+            data = m.data
+            if len(data) == 0 or data[0] != 0x41:
+                continue
+            i = 1
+            while i < len(data) and data[i] in bypid:
+                sch = bypid[data[i]]
+                size = sch.command.bytes - 2
+                if i + 1 + size > len(data):
+                    break
+                part = copy.copy(m)
+                part.data = bytearray([0x41, data[i]]) + data[i + 1:i + 1 + size]
+                responses[sch] = sch.command([part])
+                i += 1 + size
+        return responses
+
+    def run(self):
+        while self.running:
+            if not self.is_connected():
+                self.running = False
+                self.thread = None
+                return
+            sch = self.nextSchedule()
+            if sch is None:
+                time.sleep(0.25)
+                continue
+            wait = sch.dueAt() - time.monotonic()
+            if wait > 0:
+                time.sleep(min(wait, 0.25))
+                continue
+            batch = self.batchFor(sch)
+            sent = time.monotonic()
+            if len(batch) > 1:
+                responses = self.queryBatch(batch)
+                if len(responses) < len(batch):
+                    # ECUs that don't support multi-PID requests answer only the first PID or nothing,
+                    # whatever is missing stays due and goes out on its own next time around
+                    self.batchfailures += 1
+                    self.batched = self.batchfailures < 3
+                else:
+                    self.batchfailures = 0
+            else:
+                responses = {sch: super(PIDScheduler, self).query(sch.command, force=True)}
+            now = time.monotonic()
+            instruments.record("adapter round trip", now - sent)
+            self.roundtrip += 0.2 * ((now - sent) / len(batch) - self.roundtrip)
+            self.latency += 0.2 * ((now - sent) / 2 - self.latency)
+            for sch in batch:
+                sch.lastpoll = sent
+            for sch, r in responses.items():
+                if r.is_null():
+                    # NO DATA, CAN ERROR or a garbled reply: the cadence stays where it is and the command is
+                    # retried after a backoff that doubles per failure in a row, so one that keeps failing
+                    # can't starve the others
+                    sch.errors += 1
+                    sch.failures += 1
+                    sch.retry = now + min(sch.interval * 2 ** sch.failures, 5.0)
+                    instruments.count(sch.command.name + " null responses")
+                    continue
+                sch.failures = 0
+                # falling more than one interval behind restarts the cadence instead of firing a catch-up burst
+                sch.due = max(sch.due + sch.interval, now)
+                sch.response = r
+                for callback in sch.callbacks:
+                    callback(r)
+            if now - self.allocated > 0.5:
+                self.allocated = now
+                with self.lock:
+                    self.allocateRates()
+
+class DriveRecorder(object):
+    # writes every response it is handed as "time,command,value,unit" so ReplayConnection can play it back
+    def __init__(self, path):
+        self.writer = open(path, "a", buffering=1)
+        self.writer.write("time,command,value,unit\n")
+        self.start = time.monotonic()
+
+    def record(self, r):
+        if r.value is not None:
+            self.writer.write("{:.4f},{},{},{}\n".format(time.monotonic() - self.start, r.command.name,
+                                                        r.value.magnitude, r.value.units))
+
+    def close(self):
+        self.writer.close()
+
+class ReplayConnection(object):
+    # stands in for obd.Async/PIDScheduler by feeding a DriveRecorder log into the watched callbacks;
+    # speed scales the recorded timing, 0 replays as fast as possible
+    def __init__(self, path, speed=1.0, latency=0.0):
+        self.path = path
+        self.speed = speed
+        self.latency = latency #seconds the recorded samples lagged the engine, for the predictor
+        self.callbacks = {} #key = command name, value = list of Functions
+        self.responses = {} #key = command name, value = latest OBDResponse
+        self.units = {} #parsed pint units, so each unit string only goes through the parser once
+        self.thread = None
+        self.running = False
+        self.finished = threading.Event()
+        self.samples = 0
+
+    def is_connected(self):
+        return True
+
+    def status(self):
+        return obd.OBDStatus.CAR_CONNECTED
+
+    def watch(self, c, callback=None, force=False, **kwargs):
+        callbacks = self.callbacks.setdefault(c.name, [])
+        if callback is not None and callback not in callbacks:
+            callbacks.append(callback)
+
+    def unwatch(self, c, callback=None):
+        if callback in self.callbacks.get(c.name, []):
+            self.callbacks[c.name].remove(callback)
+        if callback is None or len(self.callbacks.get(c.name, [])) == 0:
+            self.callbacks.pop(c.name, None)
+
+    def unwatch_all(self):
+        self.callbacks = {}
+
+    def query(self, c, force=False):
+        return self.responses.get(c.name, obd.OBDResponse())
+
+    def throttle(self, scale, priority=0):
+        pass #a recording plays back at the rate it was recorded
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.finished.clear()
+            self.thread = threading.Thread(target=self.run, name="ReplayConnection")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.running = False
+            if self.thread is not threading.current_thread():
+                self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self.stop()
+
+    def run(self):
+        # DriveRecorder appends, so a file may hold several sessions whose times each start again at 0; the
+        # replay clock is re-based at every header line and whenever the recorded time goes backwards
+        start, last = None, 0.0
+        with open(self.path, "r") as reader:
+            for line in reader:
+                if self.running is False:
+                    break
+                fields = line.strip().split(",")
+                if fields[0] == "time":
+                    start = None
+                if len(fields) != 4 or fields[1] not in self.callbacks:
+                    continue #header lines and unwatched commands
+                try:
+                    stamp, value = float(fields[0]), float(fields[2])
+                except ValueError:
+                    continue
+                if start is None or stamp < last:
+                    start = time.monotonic() - (stamp / self.speed if self.speed > 0 else 0.0)
+                last = stamp
+                if self.speed > 0:
+                    wait = start + stamp / self.speed - time.monotonic()
+                    if wait > 0:
+                        time.sleep(wait)
+                if fields[3] not in self.units:
+                    self.units[fields[3]] = obd.Unit.parse_units(fields[3])
+                r = obd.OBDResponse(obd.commands[fields[1]], [])
+                r.value = obd.Unit.Quantity(value, self.units[fields[3]])
+                self.responses[fields[1]] = r
+                for callback in self.callbacks[fields[1]]:
+                    callback(r)
+                self.samples += 1
+        self.running = False
+        self.finished.set()
 
 def OBD2_setup():
-    connection.watch(obd.commands.SPEED, callback=new_speed) #km/h
-    connection.watch(obd.commands.RPM, callback=new_rpm)
-    connection.watch(obd.commands.MAF, callback=new_maf) #grams/sec
-    connection.watch(obd.commands.COOLANT_TEMP, callback=new_temp) #degrees Celsius
-    connection.watch(obd.commands.COMMANDED_EQUIV_RATIO, callback=new_eqr) #air/fuel ratio
+    connection.watch(obd.commands.SPEED, callback=new_speed, rate=10.0, priority=2) #km/h
+    connection.watch(obd.commands.RPM, callback=new_rpm, rate=20.0, priority=3)
+    connection.watch(obd.commands.MAF, callback=new_maf, rate=5.0, priority=1) #grams/sec
+    connection.watch(obd.commands.COOLANT_TEMP, callback=new_temp, rate=0.5, priority=0) #degrees Celsius
+    connection.watch(obd.commands.COMMANDED_EQUIV_RATIO, callback=new_eqr, rate=2.0, priority=1) #air/fuel ratio
+    if recorder is not None:
+        for command in (obd.commands.SPEED, obd.commands.RPM, obd.commands.MAF, obd.commands.COOLANT_TEMP,
+                        obd.commands.COMMANDED_EQUIV_RATIO):
+            connection.watch(command, callback=recorder.record)
     connection.start()
 
+def connectVehicle(portstr=None, fast=True, check_voltage=False, batched=False):
+    # reaches the adapter the way the last vehicle was reached and only falls back to python-obd's port scan
+    # and protocol search when that fails. blocks for as long as connecting takes, so it runs on
+    # VehicleConnector's thread or in the acquisition process
+    profiles = VehicleProfiles(os.path.join(filepath, "vehicles.txt"))
+    last = profiles.last()
+    connection = None
+    if last is not None and portstr in (None, last.port):
+        connection = PIDScheduler(last.port, last.baudrate or None, last.protocol, fast=fast,
+                                  check_voltage=check_voltage, batched=batched, profiles=profiles)
+        if not connection.is_connected():
+            connection.close()
+            connection = None
+    if connection is None:
+        connection = PIDScheduler(portstr, fast=fast, check_voltage=check_voltage, batched=batched,
+                                  profiles=profiles)
+    if connection.profile is not None:
+        profiles.remember(connection.profile)
+    return connection
+
+class VehicleConnector(QtCore.QObject):
+    # connects in the background so the window is up before the adapter answers, and keeps retrying while
+    # there's no car to talk to (ignition off, adapter unplugged)
+    connected = QtCore.pyqtSignal(object) #the connected PIDScheduler
+    state = QtCore.pyqtSignal(str) #text for the status label
+    retrydelay = 5.0 #seconds between attempts
+
+    def __init__(self, portstr=None, batched=False):
+        super(VehicleConnector, self).__init__()
+        self.portstr = portstr
+        self.batched = batched
+
+    def start(self):
+        threading.Thread(target=self.run, name="VehicleConnector", daemon=True).start()
+
+    def run(self):
+        while True:
+            self.state.emit("Connecting...")
+            connection = connectVehicle(self.portstr, batched=self.batched)
+            if connection.is_connected():
+                self.connected.emit(connection)
+                return
+            connection.close()
+            self.state.emit("No vehicle, retrying")
+            time.sleep(self.retrydelay)
+
+class CriticalDamper(object):
+    # eases a shown value toward its latest target without overshoot, stepped with the exact solution of a
+    # critically damped spring so uneven frame times can't make it unstable
+    def __init__(self, omega, value=0.0):
+        self.omega = omega #rad/s, the value covers ~98% of a jump in 6/omega seconds
+        self.value = value
+        self.velocity = 0.0
+        self.target = value
+
+    def step(self, dt):
+        offset = self.value - self.target
+        c = self.velocity + self.omega * offset
+        decay = math.exp(-self.omega * dt)
+        self.value = self.target + (offset + c * dt) * decay
+        self.velocity = (c - self.omega * (offset + c * dt)) * decay
+        return self.value
+
+    def settled(self, tolerance):
+        if abs(self.value - self.target) < tolerance and abs(self.velocity) < tolerance * self.omega:
+            self.value, self.velocity = self.target, 0.0
+            return True
+        return False
+
+class KalmanPredictor(object):
+    # constant acceleration Kalman filter over timestamped samples, predicts what the engine is doing now
+    # rather than when the adapter read it. state is [value, rate, acceleration]
+    def __init__(self, noise, jerk, horizon=0.5):
+        self.noise = noise #standard deviation of a sample
+        self.jerk = jerk #spectral density of the random jerk, higher follows sudden changes faster
+        self.horizon = horizon #seconds a prediction may run past the last sample before it holds still
+        self.state = None
+        self.covariance = None
+        self.time = None #when the latest sample was measured
+        self.arrival = None #when the latest sample arrived, to tell new samples from repeats
+        self.raw = 0.0
+        self.predicted = 0.0
+
+    def update(self, measured, value, arrival=None):
+        self.arrival = arrival
+        self.raw = value
+        if self.state is None:
+            big = self.noise ** 2 * 1e4
+            self.state = [value, 0.0, 0.0]
+            self.covariance = [[self.noise ** 2, 0.0, 0.0], [0.0, big, 0.0], [0.0, 0.0, big]]
+            self.time = measured
+            return
+        if measured <= self.time:
+            return
+        dt = measured - self.time
+        self.time = measured
+        p, v, a = self.state
+        self.state = [p + v * dt + a * dt * dt / 2, v + a * dt, a]
+        f = [[1.0, dt, dt * dt / 2], [0.0, 1.0, dt], [0.0, 0.0, 1.0]]
+        q = self.jerk
+        process = [[q * dt ** 5 / 20, q * dt ** 4 / 8, q * dt ** 3 / 6],
+                   [q * dt ** 4 / 8, q * dt ** 3 / 3, q * dt ** 2 / 2],
+                   [q * dt ** 3 / 6, q * dt ** 2 / 2, q * dt]]
+        c = self.covariance
+        fc = [[sum(f[i][k] * c[k][j] for k in range(3)) for j in range(3)] for i in range(3)]
+        c = [[sum(fc[i][k] * f[j][k] for k in range(3)) + process[i][j] for j in range(3)] for i in range(3)]
+        residual = value - self.state[0]
+        gain = [c[i][0] / (c[0][0] + self.noise ** 2) for i in range(3)]
+        self.state = [self.state[i] + gain[i] * residual for i in range(3)]
+        self.covariance = [[c[i][j] - gain[i] * c[0][j] for j in range(3)] for i in range(3)]
+
+    def predict(self, now):
+        if self.state is None:
+            return self.raw
+        dt = min(max(now - self.time, 0.0), self.horizon)
+        p, v, a = self.state
+        self.predicted = max(p + v * dt + a * dt * dt / 2, 0.0)
+        return self.predicted
+
+class RollingWindow(object):
+    # distance and fuel summed over the last `span` seconds, kept in buckets so adding a sample is O(1)
+    def __init__(self, span, bucket=1.0):
+        self.bucket = bucket
+        self.count = int(span / bucket)
+        self.distances = [0.0] * self.count
+        self.fuels = [0.0] * self.count
+        self.distance, self.fuel = 0.0, 0.0
+        self.current = None #absolute index of the bucket being filled
+
+    def add(self, now, distance, fuel):
+        index = int(now / self.bucket)
+        if self.current is None:
+            self.current = index
+        for i in range(self.current + 1, min(index, self.current + self.count) + 1):
+            # buckets that fell out of the window
+            slot = i % self.count
+            self.distance -= self.distances[slot]
+            self.fuel -= self.fuels[slot]
+            self.distances[slot], self.fuels[slot] = 0.0, 0.0
+        self.current = max(index, self.current)
+        slot = self.current % self.count
+        self.distances[slot] += distance
+        self.fuels[slot] += fuel
+        self.distance = max(self.distance + distance, 0.0)
+        self.fuel = max(self.fuel + fuel, 0.0)
+
+class FuelEconomy(object):
+    # integrates fuel flow (from MAF and commanded equivalence ratio) and distance (from speed) over
+    # the time between samples; units are liters, kilometers and seconds throughout
+    stoich = 14.7 #air/fuel mass ratio of gasoline
+    density = 453.6 * 6.701 / 3.78541 #grams of fuel per liter
+    maxgap = 5.0 #seconds, longer gaps between samples (adapter dropouts) aren't integrated
+
+    def __init__(self):
+        self.last = None #time, fuel rate and speed of the previous sample
+        self.instant = (0.0, 0.0) #distance and fuel of the latest interval
+        self.windows = {"30s": RollingWindow(30.0), "5min": RollingWindow(300.0, 10.0)}
+        self.tripdistance, self.tripfuel, self.tripengine = 0.0, 0.0, 0.0
+        self.lifetimedistance, self.lifetimefuel, self.lifetimeengine = 0.0, 0.0, 0.0
+
+    def addSample(self, now, maf, eqr, kph):
+        rate = maf / (self.stoich * (eqr if eqr > 0 else 1.0)) / self.density #liters per second
+        fuel = 0.0
+        if self.last is not None and 0 < now - self.last[0] < self.maxgap:
+            dt = now - self.last[0]
+            fuel = (self.last[1] + rate) / 2 * dt
+            distance = (self.last[2] + kph) / 2 * dt / 3600
+            self.instant = (distance, fuel)
+            for window in self.windows.values():
+                window.add(now, distance, fuel)
+            self.tripdistance += distance
+            self.tripfuel += fuel
+            self.lifetimedistance += distance
+            self.lifetimefuel += fuel
+            if rate > 0: #the engine only burns fuel while it runs
+                self.tripengine += dt
+                self.lifetimeengine += dt
+        self.last = (now, rate, kph)
+        return fuel
+
+    def totals(self, name):
+        if name == "instant":
+            return self.instant
+        if name == "trip":
+            return self.tripdistance, self.tripfuel
+        if name == "lifetime":
+            return self.lifetimedistance, self.lifetimefuel
+        return self.windows[name].distance, self.windows[name].fuel
+
+    def kmPerLiter(self, name):
+        distance, fuel = self.totals(name)
+        return distance / fuel if fuel > 0 else 0.0
+
+    def litersPer100Km(self, name):
+        distance, fuel = self.totals(name)
+        return fuel * 100 / distance if distance > 0 else 0.0
+
+    def rangeKm(self, liters):
+        # based on the recent window, so it follows a change from highway to city driving
+        return liters * self.kmPerLiter("5min")
+
+class PowerGovernor(object):
+    # picks how often the cluster polls and redraws from what the car is doing; any sign of life switches
+    # back to full rate straight away, slowing down only happens after the car has been still for a while
+    # key = state, value = (OBDThread interval, animation fps, PIDScheduler rate scale, lowest polled priority)
+    modes = {"driving": (0.015, 60, 1.0, 0),
+             "idle": (0.1, 20, 0.5, 0),
+             "off": (1.0, 5, 0.05, 2)} #only RPM and speed, to notice the engine starting
+    idledelay = 10.0 #seconds parked with a steady idle before slowing down
+    offdelay = 30.0 #seconds without RPM before nearly sleeping
+    rpmband = 150.0 #RPM away from the idle baseline that counts as activity, e.g. a blip of the throttle
+
+    def __init__(self, window):
+        self.window = window
+        self.mode = "driving"
+        self.baseline = None #slow moving average of the RPM
+        self.active = time.monotonic() #when the car last moved or the RPM last left the band
+        self.running = time.monotonic() #when the engine was last seen running
+
+    def sample(self, kph, rpm):
+        now = time.monotonic()
+        if rpm > 0:
+            self.running = now
+        if self.baseline is None:
+            self.baseline = rpm
+        if kph > 0.5 or abs(rpm - self.baseline) > self.rpmband or (rpm > 0 and self.mode == "off"):
+            self.active = now
+            if self.mode != "driving":
+                self.apply("driving")
+        self.baseline += 0.1 * (rpm - self.baseline)
+
+    def check(self):
+        now = time.monotonic()
+        if hub.rpm > 0 and "rpm" in hub.stamps:
+            self.running = max(self.running, hub.stamps["rpm"]) #a steady idle isn't emitted again
+        # a parked car with the ignition off either reports 0 RPM or stops answering altogether
+        if now - max(self.running, self.active) > self.offdelay:
+            mode = "off"
+        elif now - self.active > self.idledelay:
+            mode = "idle"
+        else:
+            mode = "driving"
+        if mode != self.mode:
+            self.apply(mode)
+
+    def apply(self, mode):
+        self.mode = mode
+        interval, framerate, scale, priority = self.modes[mode]
+        self.window.th.setIntervalTime(interval)
+        self.window.framerate = framerate
+        self.window.Animation_Timer.setInterval(int(1000 / framerate))
+        if connection is not None:
+            connection.throttle(scale, priority)
+
+class SettingsStore(object):
+    # persists the settings returned by snapshot() as versioned key=value lines, written atomically
+    # (temp file + rename) on a background thread; markDirty() batches changes into one write per delay
+    version = 2
+    legacykeys = ("metric", "colorindex", "colorindex2", "colorindex3", "shadeindex", "fuelsize", "RPMlimit",
+                  "fuellevel") #order of the space separated values in version 1 files
+
+    def __init__(self, path, snapshot, delay=30000):
+        self.path = path
+        self.snapshot = snapshot
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.generation = 0 #orders the background writes, an older snapshot never overwrites a newer one
+        self.written = 0
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.save)
+        atexit.register(self.flush)
+
+    def load(self, defaults):
+        values = dict(defaults)
+        try:
+            with open(self.path, "r") as reader:
+                lines = reader.read().splitlines()
+        except OSError:
+            return values
+        if len(lines) == 0:
+            return values
+        if lines[0].strip() == "version={}".format(self.version):
+            pairs = [line.split("=", 1) for line in lines[1:] if "=" in line]
+        else:
+            pairs = zip(self.legacykeys, lines[0].split(" "))
+        for key, text in pairs:
+            key = key.strip()
+            if key not in defaults:
+                continue
+            try:
+                if isinstance(defaults[key], bool):
+                    values[key] = bool(float(text))
+                elif isinstance(defaults[key], int):
+                    values[key] = int(float(text))
+                else:
+                    values[key] = float(text)
+            except ValueError:
+                pass #a damaged entry falls back to its default, the rest of the settings are kept
+        return values
+
+    def markDirty(self):
+        self.dirty = True
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def save(self):
+        self.timer.stop()
+        self.dirty = False
+        self.generation += 1
+        threading.Thread(target=self.write, args=(self.snapshot(), self.generation), daemon=True, name="SettingsStore").start()
+
+    def flush(self):
+        if self.dirty:
+            self.dirty = False
+            self.generation += 1
+            self.write(self.snapshot(), self.generation)
+
+    def write(self, values, generation):
+        lines = ["version={}\n".format(self.version)]
+        for key, value in values.items():
+            lines.append("{}={}\n".format(key, int(value) if isinstance(value, bool) else value))
+        with self.lock:
+            if generation < self.written:
+                return
+            try:
+                with open(self.path + ".tmp", "w") as writer:
+                    writer.writelines(lines)
+                    writer.flush()
+                    os.fsync(writer.fileno())
+                os.replace(self.path + ".tmp", self.path)
+                self.written = generation
+            except OSError:
+                self.dirty = True #e.g. a full disk, retried with the next save
+
 class MainWindow(QWidget):
     def __init__(self):
         super(MainWindow, self).__init__()
         app.focusChanged.connect(self.maintainFocus) #prevents a double clicking issue with the main buttons
         # Variables
         self.intervals = 0
-        self.SMA = 0
+        self.fuel = FuelEconomy()
+        self.rendered = {} #key = gauge, value = what it currently shows, so unchanged gauges aren't redrawn
+        self.needlestep = math.degrees(0.25 / 210) #rotation moving the needle tip (210px out) a quarter pixel
+        self.framerate = 60 #frames per second of the needle and speed animation while they are moving
+        self.needle = CriticalDamper(25.0) #tach needle angle in degrees
+        self.speedometer = CriticalDamper(25.0) #speed in km/h
+        self.lastframe = 0.0
+        self.predictors = {} #key = hub sample name, value = KalmanPredictor, only used with OBD_PREDICT=1
+        if os.environ.get("OBD_PREDICT") == "1":
+            self.predictors = {"rpm": KalmanPredictor(15.0, 1e7), "speed": KalmanPredictor(0.5, 1e3)}
         self.RPMlimit = 6.0
         self.radius = 190
         self.centerX = 408
@@ -127,30 +920,26 @@ class MainWindow(QWidget):
         self.lockout2 = False #this is used to prevent multiple instances of the Data Logger menu
         self.menus = [] #list of all open menus, used for hiding menus when returning to home screen
         self.labels = [] #list of labels, used for changing labels to white when background is black
+        self.stopped = False #used to save the config once each time the car comes to a stop
         # Read Config File
-        try:
-            with open(filepath + "config.txt", "r") as reader:
-                config = reader.read()
-                config_values = [str(x) for x in config.split(" ")]
-                self.metric = bool(float(config_values[0]))
-                self.colorindex = int(float(config_values[1]))
-                self.colorindex2 = int(float(config_values[2]))
-                self.colorindex3 = int(float(config_values[3]))
-                self.shadeindex = int(float(config_values[4]))
-                self.fuelsize = float(config_values[5])
-                self.RPMlimit = float(config_values[6])
-                self.fuellevel = float(config_values[7])
-        except:
-            with open(filepath + "config.txt", "w") as writer:
-                L = [str(float(self.metric)) + " ",
-                     str(float(self.colorindex)) + " ",
-                     str(float(self.colorindex2)) + " ",
-                     str(float(self.colorindex3)) + " ",
-                     str(float(self.shadeindex)) + " ",
-                     str(float(self.fuelsize)) + " ",
-                     str(float(self.RPMlimit)) + " ",
-                     str(float(self.fuellevel))]
-                writer.writelines(L)
+        self.config = SettingsStore(filepath + "config.txt", self.configValues)
+        for key, value in self.config.load(self.configValues()).items():
+            setattr(self.fuel if key.startswith("lifetime") else self, key, value)
+        # Recover the trip journal, newer than the config whenever the power went before the last stop
+        self.journal = TripJournal(filepath + "trips.journal")
+        self.trip = 1
+        last = self.journal.last
+        if last is not None:
+            self.fuellevel = last.fuellevel
+            self.fuel.lifetimedistance, self.fuel.lifetimefuel = last.distance, last.fuel
+            self.fuel.lifetimeengine = last.engine
+            self.trip = last.trip + 1
+            if time.time() - last.time < 300: #a power blip during a drive carries on with the same trip
+                self.trip = last.trip
+                self.fuel.tripdistance, self.fuel.tripfuel = last.tripdistance, last.tripfuel
+                self.fuel.tripengine = last.tripengine
+        self.journaled = None #totals of the last checkpoint, a parked car doesn't write the same one again
+        self.journal.start()
 
         self.pen1 = QPen(self.colors[self.colorindex2], 3, Qt.DashLine, Qt.RoundCap)
         self.paletteSetUp()
@@ -222,6 +1011,7 @@ class MainWindow(QWidget):
         self.Header_Label.setObjectName("Header_Label")
         self.Header_Label.setText("Home")
         self.Header_Label.setPalette(self.mainPalette)
+        self.Header_Label.installEventFilter(self) #holding it down opens the diagnostics page
         self.labels.append(self.Header_Label)
 
         Tach_Label = QtWidgets.QLabel(self)
@@ -240,8 +1030,6 @@ class MainWindow(QWidget):
         Tach_Sub_Label.setText("X 1000")
         self.labels.append(Tach_Sub_Label)
 
-        self.tachSetup()
-
         Temp_Label = QtWidgets.QLabel(self)
         Temp_Label.setGeometry(QtCore.QRect(97, 48, 180, 24))
         Temp_Label.setFont(small_font)
@@ -287,6 +1075,13 @@ class MainWindow(QWidget):
         self.Time_Label.setObjectName("Time_Label")
         self.labels.append(self.Time_Label)
 
+        self.Status_Label = QtWidgets.QLabel(self)
+        self.Status_Label.setGeometry(QtCore.QRect(400, 12, 290, 24))
+        self.Status_Label.setFont(small_font)
+        self.Status_Label.setAlignment(QtCore.Qt.AlignRight)
+        self.Status_Label.setObjectName("Status_Label")
+        self.labels.append(self.Status_Label)
+
         self.Speed_Label = QtWidgets.QLabel(self)
         self.Speed_Label.setGeometry(QtCore.QRect(423,263,328,215))
         self.Speed_Label.setFont(big_font)
@@ -350,8 +1145,7 @@ class MainWindow(QWidget):
         Gauge_Cluster_View.lower()
         Gauge_Cluster_View.setRenderHints(QPainter.Antialiasing)
         # Add scene items
-        self.Tach_Ring = self.Guage_Cluster.addEllipse(208, 51, 425, 425, self.pen1, self.shades[self.shadeindex])
-        self.Speed_Rect = self.Guage_Cluster.addRect(423, 263, 215, 215, Qt.transparent, self.shades[self.shadeindex])
+        self.tachSetup()
         self.Tach_Pointer = self.Guage_Cluster.addRect(420, 228, 5, 245, self.colors[self.colorindex], self.colors[self.colorindex])
         self.Tach_Pointer.setTransformOriginPoint(423, 263)
         self.Tach_Pivot = self.Guage_Cluster.addEllipse(408, 247, 30, 30, self.colors[self.colorindex], Qt.black)
@@ -363,37 +1157,177 @@ class MainWindow(QWidget):
             self.Home_Button.setIcon(QIcon(filepath + "homeiconI.png"))
             for label in self.labels:
                 label.setPalette(self.mainPalette)
+        # Timers
+        self.Clock_Timer = QtCore.QTimer(self)
+        self.Clock_Timer.setSingleShot(True)
+        self.Clock_Timer.timeout.connect(self.clockUpdate)
+        self.clockUpdate()
+        self.Animation_Timer = QtCore.QTimer(self)
+        self.Animation_Timer.setTimerType(Qt.PreciseTimer)
+        self.Animation_Timer.setInterval(int(1000 / self.framerate))
+        self.Animation_Timer.timeout.connect(self.animationStep)
         # Threads
         self.th = OBDThread()
         self.th.signal.connect(self.displayUpdate)
         self.th.start()
+        self.governor = PowerGovernor(self)
+        self.Governor_Timer = QtCore.QTimer(self)
+        self.Governor_Timer.setInterval(1000)
+        self.Governor_Timer.timeout.connect(self.governor.check)
+        self.Governor_Timer.start()
+        self.Journal_Timer = QtCore.QTimer(self)
+        self.Journal_Timer.setInterval(10000)
+        self.Journal_Timer.timeout.connect(self.journalCheckpoint)
+        self.Journal_Timer.start()
+        # Diagnostics
+        self.updated = None #when displayUpdate last finished, until the window is painted
+        self.diag = None
+        self.Diagnostics_Hold_Timer = QtCore.QTimer(self)
+        self.Diagnostics_Hold_Timer.setSingleShot(True)
+        self.Diagnostics_Hold_Timer.setInterval(2000)
+        self.Diagnostics_Hold_Timer.timeout.connect(self.openDiagnostics)
+        self.Diagnostics_Timer = QtCore.QTimer(self)
+        self.Diagnostics_Timer.setInterval(60000)
+        self.Diagnostics_Timer.timeout.connect(self.dumpDiagnostics)
+        self.Diagnostics_Timer.start()
+
+    def event(self, event):
+        # an UpdateRequest is where Qt paints every dirty widget of the window and flushes it to the screen
+        if event.type() != QtCore.QEvent.UpdateRequest:
+            return super(MainWindow, self).event(event)
+        start = time.monotonic()
+        if self.updated is not None:
+            instruments.record("update to paint", start - self.updated)
+            self.updated = None
+        result = super(MainWindow, self).event(event)
+        instruments.record("paint", time.monotonic() - start)
+        return result
+
+    def eventFilter(self, watched, event):
+        if watched is self.Header_Label:
+            if event.type() == QtCore.QEvent.MouseButtonPress:
+                self.Diagnostics_Hold_Timer.start()
+            elif event.type() == QtCore.QEvent.MouseButtonRelease:
+                self.Diagnostics_Hold_Timer.stop()
+        return super(MainWindow, self).eventFilter(watched, event)
+
+    def diagnosticsExtra(self):
+        extra = {"governor mode": self.governor.mode}
+        if self.lockout2 is True and self.dl.writer is not None:
+            extra["log rows dropped"] = self.dl.writer.dropped
+        if isinstance(connection, PIDScheduler):
+            extra["scheduler round trip ms"] = "{:.1f}".format(connection.roundtrip * 1000)
+            extra["scheduler latency ms"] = "{:.1f}".format(connection.latency * 1000)
+            extra["scheduler batched"] = connection.batched
+        elif isinstance(connection, AcquisitionProcess):
+            extra["scheduler round trip ms"] = "{:.1f}".format(connection.roundtrip * 1000)
+            extra["scheduler latency ms"] = "{:.1f}".format(connection.latency * 1000)
+            extra["acquisition restarts"] = connection.restarts
+            extra["acquisition samples lost"] = connection.lost
+        return extra
+
+    def openDiagnostics(self):
+        if self.diag is None:
+            self.diag = DiagnosticsPage()
+            self.diag.setCursor(Qt.BlankCursor)
+        self.diag.show()
+        self.diag.raise_()
+
+    def dumpDiagnostics(self):
+        # the extra values are read here on the GUI thread, formatting and writing the report happen on a
+        # thread of their own so the dump doesn't stall the paints it measures
+        threading.Thread(target=self.writeDiagnostics, args=(self.diagnosticsExtra(),), daemon=True,
+                         name="DiagnosticsDump").start()
+
+    def writeDiagnostics(self, extra):
+        try:
+            instruments.dump(filepath + "diagnostics.txt", extra)
+        except OSError:
+            pass #e.g. a full disk, the next dump tries again
 
-    def displayUpdate(self, t, s, r, e, m, nom):
+    def connectionState(self, text):
+        self.Status_Label.setText(text)
+
+    def vehicleConnected(self, vehicle):
+        global connection
+        connection = vehicle
+        self.Status_Label.setText("")
+        OBD2_setup()
+        self.governor.apply(self.governor.mode) #a throttle decided while connecting
+
+    def clockUpdate(self):
         currentTime = datetime.now()
-        self.Time_Label.setText("{}:{}".format(currentTime.strftime("%I"), currentTime.strftime("%M")))
-        self.Temp_Display.display(int(t))
-        self.Speed_Label.setText(str(int(s)))
-        if int(s) == 0:
+        self.Time_Label.setText(currentTime.strftime("%I:%M"))
+        # wake up again just after the next minute starts
+        self.Clock_Timer.start(int((60 - currentTime.second) * 1000 - currentTime.microsecond / 1000) + 50)
+
+    def renderGauge(self, gauge, value, setter):
+        if self.rendered.get(gauge) != value:
+            self.rendered[gauge] = value
+            setter(value)
+
+    def animationStep(self):
+        # moves the needle and the speed readout toward the latest samples, the timer stops once both settle
+        now = time.monotonic()
+        dt = min(now - self.lastframe, 0.1) #after a stall, catch up instead of jumping
+        self.lastframe = now
+        if self.predictors:
+            self.needle.target = self.predictors["rpm"].predict(now) / (self.RPMlimit * 1000) * 270
+            self.speedometer.target = self.predictors["speed"].predict(now)
+        angle = self.needle.step(dt)
+        speed = self.speedometer.step(dt)
+        needlesettled = self.needle.settled(self.needlestep)
+        settled = self.speedometer.settled(0.05) and needlesettled
+        if settled:
+            angle, speed = self.needle.value, self.speedometer.value
+            self.Animation_Timer.stop()
+        if abs(angle - self.rendered.get("needle", -360)) >= self.needlestep or settled:
+            self.rendered["needle"] = angle
+            self.Tach_Pointer.setRotation(angle)
+        self.renderGauge("speed", str(int(round(convert(self.metric, "speed", speed), 6))), self.Speed_Label.setText)
+
+    def displayUpdate(self, t, s, r, e, m, nom):
+        start = time.monotonic()
+        instruments.record("emit to update", start - self.th.emitted)
+        metric = self.metric #read once, the settings menu may flip it between frames
+        self.renderGauge("temp", int(convert(metric, "temp", t)), self.Temp_Display.display)
+        speed = int(convert(metric, "speed", s))
+        if speed == 0 and self.stopped is False:
             self.saveToConfig()
-        self.Tach_Pointer.setRotation(r / (self.RPMlimit * 1000) * 270)
-        self.Eqr_Display.display(e * 14.7)
+            self.journalCheckpoint()
+        self.stopped = speed == 0
+        self.governor.sample(s, r)
+        rpm, kph = r, s
+        if self.predictors:
+            latency = getattr(connection, "latency", 0.0)
+            for name, value in (("rpm", r), ("speed", s)):
+                stamp = hub.stamps.get(name)
+                if stamp is not None and stamp != self.predictors[name].arrival:
+                    self.predictors[name].update(stamp - latency, value, stamp)
+            now = time.monotonic()
+            rpm, kph = self.predictors["rpm"].predict(now), self.predictors["speed"].predict(now)
+        self.needle.target = rpm / (self.RPMlimit * 1000) * 270
+        self.speedometer.target = kph
+        if not self.Animation_Timer.isActive():
+            self.lastframe = time.monotonic() - 1.0 / self.framerate
+            self.Animation_Timer.start()
+        self.renderGauge("eqr", round(e * 14.7, 2), self.Eqr_Display.display)
         if nom != self.intervals:
             self.intervals = nom
-            gps = ((m/14.7)/453.6)/6.701 #gallons per second
-            mpg = s/(gps*3600) #instantaneous miles per gallon
-            self.SMA = self.SMA + mpg
-            if self.metric is True:
-                try:
-                    self.MPG_Display.display(235.215/self.SMA/nom)
-                except:
-                    self.MPG_Display.display(0)
-                lps = gps * 3.78541 #liters per second
-                self.fuellevel = self.fuellevel - lps
-                self.Range_Display.display(int(self.SMA / nom * self.fuellevel))
+            liters = self.fuel.addSample(hub.stamps.get("maf", time.monotonic()), m, e, s)
+            self.fuellevel = self.fuellevel - convert(metric, "volume", liters) #the tank is set up in display units
+            if metric is True:
+                economy = self.fuel.litersPer100Km("5min")
             else:
-                self.fuellevel = self.fuellevel - gps
-                self.Range_Display.display(int(self.SMA/nom * self.fuellevel))
-            self.Fuel_Guage.setValue(int(self.fuellevel / self.fuelsize * 100))
+                economy = self.fuel.kmPerLiter("5min") * 2.352146
+            self.renderGauge("economy", round(economy, 1), self.MPG_Display.display)
+            tankliters = self.fuellevel / convert(metric, "volume", 1.0)
+            self.renderGauge("range", int(convert(metric, "distance", self.fuel.rangeKm(tankliters))),
+                             self.Range_Display.display)
+            self.renderGauge("fuel", int(self.fuellevel / self.fuelsize * 100), self.Fuel_Guage.setValue)
+            self.config.markDirty()
+        self.updated = time.monotonic()
+        instruments.record("displayUpdate", self.updated - start)
 
     def paletteSetUp(self):
         self.mainPalette = QPalette()
@@ -401,7 +1335,8 @@ class MainWindow(QWidget):
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Escape:
-            connection.stop()
+            if connection is not None: #still connecting
+                connection.stop()
             sys.exit(app.exec_())
 
     def resetFuelDialog(self):
@@ -434,28 +1369,45 @@ class MainWindow(QWidget):
 
     def resetFuelLevel(self):
         self.fuellevel = self.fuelsize
+        self.config.markDirty()
+        self.journalCheckpoint()
+
+    def journalCheckpoint(self):
+        f = self.fuel
+        totals = (f.tripdistance, f.tripfuel, f.tripengine, f.lifetimedistance, f.lifetimefuel, f.lifetimeengine,
+                  self.fuellevel)
+        if totals != self.journaled:
+            self.journaled = totals
+            self.journal.checkpoint(Checkpoint(self.trip, time.time(), *totals))
 
     def tachSetup(self):
-        self.RPM_Labels = []
-        palette = QPalette()
-        palette.setColor(QPalette.All, QPalette.Foreground, self.colors[self.colorindex3])
+        # the static tach face (ring, speed box and numerals) is painted once into a pixmap under the needle,
+        # it only has to be painted again when the RPM limit, the colors or the background change
+        face = QPixmap(800, 480)
+        face.fill(Qt.transparent)
+        painter = QPainter(face)
+        painter.setRenderHints(QPainter.Antialiasing | QPainter.TextAntialiasing)
+        painter.setPen(self.pen1)
+        painter.setBrush(self.shades[self.shadeindex])
+        painter.drawEllipse(208, 51, 425, 425)
+        painter.setPen(Qt.NoPen)
+        painter.drawRect(423, 263, 215, 215)
+        painter.setPen(self.colors[self.colorindex3])
+        painter.setFont(font)
         for i in range(0,int(2*self.RPMlimit)+1):
             if i%2 == 0:
-                self.RPM_Labels.append(QtWidgets.QLabel(self))
                 deg_angle = 90-((-270 * i) / (2 * self.RPMlimit))
                 rad_angle = (math.pi * deg_angle) / 180
-                self.RPM_Labels[int(i/2)].setGeometry(int((self.centerX-24)+(self.radius*math.cos(rad_angle))),
-                                     int((self.centerY-24)+(self.radius*math.sin(rad_angle))),
-                                     48, 48)
-                self.RPM_Labels[int(i/2)].setFont(font)
-                self.RPM_Labels[int(i / 2)].setPalette(palette)
-                self.RPM_Labels[int(i/2)].setAlignment(QtCore.Qt.AlignRight)
-                self.RPM_Labels[int(i/2)].setText(str(int(i/2)))
-                self.RPM_Labels[int(i/2)].show()
+                painter.drawText(QtCore.QRect(int((self.centerX-24)+(self.radius*math.cos(rad_angle))),
+                                              int((self.centerY-24)+(self.radius*math.sin(rad_angle))), 48, 48),
+                                 QtCore.Qt.AlignRight, str(int(i/2)))
+        painter.end()
+        self.Tach_Face = self.Guage_Cluster.addPixmap(face)
+        self.Tach_Face.setZValue(-1) #keeps the needle on top
 
     def tachDestroy(self):
-        for labels in self.RPM_Labels:
-            labels.hide()
+        self.Guage_Cluster.removeItem(self.Tach_Face)
+        self.Tach_Face = None
 
     def returnHome(self):
         if self.Home_Button.isChecked() is True:
@@ -463,17 +1415,20 @@ class MainWindow(QWidget):
             for menu in self.menus:
                 menu.hide()
 
+    def configValues(self):
+        return {"metric": self.metric,
+                "colorindex": self.colorindex,
+                "colorindex2": self.colorindex2,
+                "colorindex3": self.colorindex3,
+                "shadeindex": self.shadeindex,
+                "fuelsize": self.fuelsize,
+                "RPMlimit": self.RPMlimit,
+                "fuellevel": self.fuellevel,
+                "lifetimedistance": self.fuel.lifetimedistance,
+                "lifetimefuel": self.fuel.lifetimefuel}
+
     def saveToConfig(self):
-        with open(filepath + "config.txt", "w") as writer:
-            L = [str(float(self.metric)) + " ",
-                 str(float(self.colorindex)) + " ",
-                 str(float(self.colorindex2)) + " ",
-                 str(float(self.colorindex3)) + " ",
-                 str(float(self.shadeindex)) + " ",
-                 str(float(self.fuelsize)) + " ",
-                 str(float(self.RPMlimit)) + " ",
-                 str(float(self.fuellevel))]
-            writer.writelines(L)
+        self.config.save()
         self.paletteSetUp()
 
     def createDataLogMenu(self):
@@ -514,6 +1469,122 @@ class MainWindow(QWidget):
             self.sm.hide()
             self.Header_Label.setText("Home")
 
+class LogTableModel(QtCore.QAbstractTableModel):
+    # fixed capacity ring of the most recent log rows, the view only asks for the rows it shows
+    def __init__(self, headers, capacity=500):
+        super(LogTableModel, self).__init__()
+        self.headers = headers
+        self.capacity = capacity
+        self.rows = collections.deque(maxlen=capacity)
+        self.pending = [] #rows waiting for the next flush, so the view is told about them in batches
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return "{:g}".format(self.rows[index.row()][index.column()])
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+    def append(self, row):
+        self.pending.append(row)
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return False
+        rows = self.pending[-self.capacity:]
+        self.pending = []
+        overflow = len(self.rows) + len(rows) - self.capacity
+        if overflow > 0:
+            self.beginRemoveRows(QtCore.QModelIndex(), 0, overflow - 1)
+            for i in range(overflow):
+                self.rows.popleft()
+            self.endRemoveRows()
+        self.beginInsertRows(QtCore.QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+        self.rows.extend(rows)
+        self.endInsertRows()
+        return True
+
+def decimate(rows, start, span, width):
+    # folds history rows into one (x, min, max) per pixel column, keeping every peak however many rows
+    # there are; rows are (time, min, max, mean) as TimeSeriesStore.query returns them
+    columns = []
+    scale = width / span
+    for t, low, high, mean in rows:
+        x = int((t - start) * scale)
+        if x < 0 or x >= width:
+            continue
+        if columns and columns[-1][0] == x:
+            column = columns[-1]
+            columns[-1] = (x, min(column[1], low), max(column[2], high))
+        else:
+            columns.append((x, low, high))
+    return columns
+
+class StripChart(QWidget):
+    # live graph of the hub history, one lane per channel. each lane is drawn as a single QPainterPath
+    # through the per pixel min/max, so the cost follows the width of the chart rather than the samples
+    # (hub channel, (lane title, unit quantity or None, lowest and highest raw value shown))
+    lanes = (("speed", ("Speed", "speed", 0.0, 200.0)),
+             ("rpm", ("RPM", None, 0.0, 8000.0)),
+             ("temp", ("Coolant Temp", "temp", 40.0, 120.0)),
+             ("eqr", ("Eqv. Ratio", None, 0.6, 1.4)))
+
+    def __init__(self, parent, span=300.0):
+        super(StripChart, self).__init__(parent)
+        self.span = span #seconds across the chart
+        self.sequence = -1 #hub sequence last drawn, so nothing is redrawn while no data arrives
+        self.Chart_Timer = QtCore.QTimer(self)
+        self.Chart_Timer.setInterval(250)
+        self.Chart_Timer.timeout.connect(self.chartUpdate)
+        self.Chart_Timer.start()
+
+    def chartUpdate(self):
+        if self.isVisible() and hub.sequence != self.sequence:
+            self.sequence = hub.sequence
+            self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setFont(small_font)
+        now = time.monotonic()
+        start = now - self.span
+        width = self.width()
+        height = self.height() / len(self.lanes)
+        for index, (name, (title, quantity, low, high)) in enumerate(self.lanes):
+            top = index * height
+            if name == "rpm":
+                high = mw.RPMlimit * 1000
+            painter.setPen(mw.colors[mw.colorindex2])
+            painter.drawLine(0, int(top + height) - 1, width, int(top + height) - 1)
+            resolution, rows = hub.history.query(name, self.span, now, points=width)
+            columns = decimate(rows, start, self.span, width)
+            scale = (height - 4) / (high - low)
+            bottom = top + height - 2 + low * scale #y = bottom - value * scale
+            path = QtGui.QPainterPath()
+            for x, smallest, largest in columns:
+                if path.elementCount() == 0:
+                    path.moveTo(x, bottom - min(max(largest, low), high) * scale)
+                else:
+                    path.lineTo(x, bottom - min(max(largest, low), high) * scale)
+                path.lineTo(x, bottom - min(max(smallest, low), high) * scale)
+            painter.setPen(QPen(mw.colors[mw.colorindex], 1))
+            painter.drawPath(path)
+            latest = getattr(hub, name)
+            if quantity is not None:
+                latest = convert(mw.metric, quantity, latest)
+            painter.setPen(mw.mainPalette.color(QPalette.Foreground))
+            painter.drawText(QtCore.QRectF(4, top + 2, width - 8, 24), Qt.AlignLeft,
+                             "{}: {:.5g}".format(title, latest))
+
 class DataLogger(QWidget):
     def __init__(self):
         super().__init__()
@@ -524,9 +1595,9 @@ class DataLogger(QWidget):
         self.setObjectName("Data Logger")
         # Variables
         self.datalogging = False
-        self.firstlinewritten = False
-        self.intervals = 0
-        self.SMA = 0
+        self.writer = None
+        self.channels = ("temp", "speed", "rpm", "mpg", "fuel", "eqr", "maf",
+                         "speed_predicted", "rpm_predicted") #columns of the binary log
         # Buttons
         self.Switch_Group = QtWidgets.QButtonGroup(self)
         self.Switch_Button = QtWidgets.QPushButton(self)
@@ -541,51 +1612,127 @@ class DataLogger(QWidget):
         self.Switch_Label.setAlignment(QtCore.Qt.AlignLeft)
         self.Switch_Label.setText("Data Logging: Disabled")
         mw.labels.append(self.Switch_Label)
-        # Text Edit Box
-        self.Data_Text_Box = QtWidgets.QTextEdit(self)
-        self.Data_Text_Box.setReadOnly(True)
-        self.Data_Text_Box.setGeometry(3,45,698,380)
-
+        # Table
+        self.Data_Model = LogTableModel(CSV_HEADER.strip().split(","))
+        self.Data_Table = QtWidgets.QTableView(self)
+        self.Data_Table.setGeometry(3,45,698,380)
+        self.Data_Table.setModel(self.Data_Model)
+        self.Data_Table.setFont(small_font)
+        self.Data_Table.verticalHeader().hide()
+        self.Data_Table.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+        self.Data_Table.verticalHeader().setDefaultSectionSize(24)
+        self.Data_Table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
+        self.Data_Table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        # Graph
+        self.Strip_Chart = StripChart(self)
+        self.Strip_Chart.setGeometry(3,45,698,380)
+        self.Strip_Chart.hide()
+        self.View_Button = QtWidgets.QPushButton(self)
+        self.View_Button.setGeometry(599, 5, 100, 36)
+        self.View_Button.setFont(small_font)
+        self.View_Button.setText("Graph")
+        self.View_Button.clicked.connect(self.switchView)
+        # Timers
+        self.Table_Timer = QtCore.QTimer(self)
+        self.Table_Timer.setInterval(500)
+        self.Table_Timer.timeout.connect(self.tableUpdate)
+        self.Table_Timer.start()
+        # Threads
+        self.th = OBDThread("logger")
+        self.th.setIntervalTime(1.0)
+        self.th.signal.connect(self.logData)
+        self.th.start()
 
     def switchLoggingState(self):
         self.datalogging = not self.datalogging
-        self.th = OBDThread()
-        self.th.setIntervalTime(1.0)
         if self.datalogging is True:
-            self.th.signal.connect(self.logData)
-            self.th.start()
+            options = {"fsync": os.environ.get("OBD_LOG_FSYNC", "interval"),
+                       "maxsize": int(float(os.environ.get("OBD_LOG_SEGMENT_MB", "16")) * 1024 * 1024),
+                       "budget": int(float(os.environ.get("OBD_LOG_BUDGET_MB", "512")) * 1024 * 1024),
+                       "previous": self.writer} #the new writer waits for the old one to finish flushing
+            if os.environ.get("OBD_LOG_FORMAT") == "binary":
+                self.writer = BinaryLogWriter(filepath + "datalog.bin", self.channels, **options)
+            else:
+                self.writer = LogWriter(filepath + "datalog.csv", header=CSV_HEADER, **options)
+            self.writer.start()
             self.Switch_Label.setText("Data Logging: Enabled")
             self.Switch_Button.setIcon(QIcon(filepath + "checkmark.png"))
             self.Switch_Button.setIconSize(self.Switch_Button.rect().size() * 0.9)
         else:
-            self.th.quit()
+            self.writer.close(wait=False)
             self.Switch_Label.setText("Data Logging: Disabled")
             self.Switch_Button.setIcon(QIcon(None))
 
     def logData(self, t, s, r, e, m, nom):
         if self.datalogging is True:
-            gps = ((m/(e * 14.7))/453.6)/6.701 #gallons per second
-            mpg = s/(gps*3600) #instantaneous miles per gallon
-            if mw.metric is True:
-                try:
-                    mpg = 235.215/mpg #while at a stop the mpg is 0
-                except:
-                    mpg = 0
-            with open("datalog.csv", "a") as writer:
-                if self.firstlinewritten is False:
-                    L =  "Temp,Speed,RPM,MPG, Fuel Level\n"
-                    writer.write(L)
-                    self.Data_Text_Box.append(L)
-                    self.firstlinewritten = True
-                L = "{},{},{},{},{}\n".format(t,s,r,mpg,mw.fuellevel)
-                writer.write(L)
-                self.Data_Text_Box.append(L)
+            metric = mw.metric
+            kph = s
+            t = convert(metric, "temp", t)
+            s = convert(metric, "speed", s)
+            if metric is True:
+                mpg = mw.fuel.litersPer100Km("instant")
+            else:
+                mpg = mw.fuel.kmPerLiter("instant") * 2.352146
+            if isinstance(self.writer, BinaryLogWriter):
+                now = time.monotonic()
+                # the same as the raw values unless the predictor is on
+                predictions = [mw.predictors[name].predict(now) if name in mw.predictors else raw
+                               for name, raw in (("speed", kph), ("rpm", r))]
+                predictions[0] = convert(metric, "speed", predictions[0])
+                self.writer.write(now, (t, s, r, mpg, mw.fuellevel, e, m) + tuple(predictions))
+            else:
+                self.writer.write("{},{},{},{},{}\n".format(t,s,r,mpg,mw.fuellevel))
+            self.Data_Model.append((t, s, r, mpg, mw.fuellevel))
+
+    def switchView(self):
+        graph = self.Strip_Chart.isHidden()
+        self.Strip_Chart.setVisible(graph)
+        self.Data_Table.setVisible(not graph)
+        self.View_Button.setText("Table" if graph else "Graph")
+
+    def tableUpdate(self):
+        scrollbar = self.Data_Table.verticalScrollBar()
+        following = scrollbar.value() == scrollbar.maximum() #only keep scrolling if the user hasn't scrolled up
+        if self.Data_Model.flush() and following:
+            self.Data_Table.scrollToBottom()
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Escape:
-            connection.stop()
+            if connection is not None: #still connecting
+                connection.stop()
             sys.exit(app.exec_())
 
+class DiagnosticsPage(QWidget):
+    # hidden page with the latency histograms, sample rates and counters, tap it to close it again
+    def __init__(self):
+        super().__init__()
+        # Window Set Up
+        self.setGeometry(97, 49, 702, 430)
+        self.setWindowFlags(QtCore.Qt.FramelessWindowHint)
+        self.setPalette(mw.mainPalette)
+        self.setObjectName("Diagnostics")
+        # Labels
+        mono_font = QtGui.QFont("Monospace", 9)
+        mono_font.setStyleHint(QtGui.QFont.TypeWriter)
+        self.Report_Label = QtWidgets.QLabel(self)
+        self.Report_Label.setGeometry(3, 3, 696, 424)
+        self.Report_Label.setFont(mono_font)
+        self.Report_Label.setAlignment(QtCore.Qt.AlignLeft | QtCore.Qt.AlignTop)
+        self.Report_Label.setPalette(mw.mainPalette)
+        # Timers
+        self.Report_Timer = QtCore.QTimer(self)
+        self.Report_Timer.setInterval(1000)
+        self.Report_Timer.timeout.connect(self.reportUpdate)
+        self.Report_Timer.start()
+        self.reportUpdate()
+
+    def reportUpdate(self):
+        if self.isVisible() or self.Report_Label.text() == "":
+            self.Report_Label.setText(instruments.report(mw.diagnosticsExtra()))
+
+    def mousePressEvent(self, event):
+        self.hide()
+
 class SettingsMenu(QWidget):
     def __init__(self):
         super().__init__()
@@ -848,6 +1995,7 @@ class SettingsMenu(QWidget):
                 self.shadebuttons.button(i).setChecked(True)
 
     def changePointerColor(self, index):
+        mw.config.markDirty()
         mw.colorindex = int(index)
         mw.Tach_Pointer.setBrush(mw.colors[mw.colorindex])
         mw.Tach_Pointer.setPen(mw.colors[mw.colorindex])
@@ -859,9 +2007,11 @@ class SettingsMenu(QWidget):
                 button.setIcon(QIcon(None))
 
     def changeTachRingColor(self, index):
+        mw.config.markDirty()
         mw.colorindex2 = int(index)
         mw.pen1.setColor(mw.colors[mw.colorindex2])
-        mw.Tach_Ring.setPen(mw.pen1)
+        mw.tachDestroy()
+        mw.tachSetup()
         for button in self.colorbuttons2.buttons():
             if button.isChecked():
                 button.setIcon(QIcon(filepath + "checkmark.png"))
@@ -869,6 +2019,7 @@ class SettingsMenu(QWidget):
                 button.setIcon(QIcon(None))
 
     def changeTachNumberColor(self, index):
+        mw.config.markDirty()
         mw.colorindex3 = int(index)
         mw.tachDestroy()
         mw.tachSetup()
@@ -879,6 +2030,7 @@ class SettingsMenu(QWidget):
                 button.setIcon(QIcon(None))
 
     def changeBackgroundColor(self, index):
+        mw.config.markDirty()
         mw.shadeindex = int(index)
         mw.mainPalette.setColor(QPalette.All, QPalette.Background, mw.shades[mw.shadeindex])
         if mw.shadeindex == 4:
@@ -894,8 +2046,8 @@ class SettingsMenu(QWidget):
         mw.setPalette(mw.mainPalette)
         self.setPalette(mw.mainPalette)
         mw.Guage_Cluster.setBackgroundBrush(mw.shades[mw.shadeindex])
-        mw.Speed_Rect.setBrush(mw.shades[mw.shadeindex])
-        mw.Tach_Ring.setBrush(mw.shades[mw.shadeindex])
+        mw.tachDestroy()
+        mw.tachSetup()
         mw.Home_Button.setStyleSheet("background-color:{}; border:None".format(self.shades[mw.shadeindex]))
         mw.Data_Log_Button.setStyleSheet("background-color:{}; border:None".format(self.shades[mw.shadeindex]))
         mw.Settings_Button.setStyleSheet("background-color:{}; border:None".format(self.shades[mw.shadeindex]))
@@ -910,6 +2062,7 @@ class SettingsMenu(QWidget):
                 button.setIcon(QIcon(None))
 
     def changeRPMLimit(self, index):
+        mw.config.markDirty()
         if index == 0:
             mw.RPMlimit += 0.5
             self.RPM_Limit_Display.display(mw.RPMlimit)
@@ -923,6 +2076,7 @@ class SettingsMenu(QWidget):
             mw.tachSetup()
 
     def changeTankSize(self, index):
+        mw.config.markDirty()
         if index == 0:
             mw.fuelsize += 0.5
             self.Tank_Size_Display.display(mw.fuelsize)
@@ -932,6 +2086,7 @@ class SettingsMenu(QWidget):
             self.Tank_Size_Display.display(mw.fuelsize)
 
     def unitChange(self):
+        mw.config.markDirty()
         if self.Metric_Button.isChecked():
             self.Metric_Button.setIcon(QIcon(filepath + "checkmark.png"))
             self.Imperial_Button.setIcon(QIcon(None))
@@ -953,14 +2108,32 @@ class SettingsMenu(QWidget):
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Escape:
-            connection.stop()
+            if connection is not None: #still connecting
+                connection.stop()
             sys.exit(app.exec_())
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
+    if os.environ.get("OBD_PROFILE") == "1":
+        profiler = SamplingProfiler(filepath, period=float(os.environ.get("OBD_PROFILE_PERIOD", "300")))
+        profiler.start()
     mw = MainWindow()
-    connection = obd.Async(fast=True, check_voltage=False)
-    OBD2_setup()
+    recorder = None
+    if os.environ.get("OBD_RECORD"):
+        recorder = DriveRecorder(os.environ["OBD_RECORD"])
+    if os.environ.get("OBD_REPLAY"):
+        connection = ReplayConnection(os.environ["OBD_REPLAY"], float(os.environ.get("OBD_REPLAY_SPEED", "1")),
+                                      float(os.environ.get("OBD_REPLAY_LATENCY", "0")))
+    elif os.environ.get("OBD_ACQUISITION") == "process":
+        connection = AcquisitionProcess(connectVehicle, os.environ.get("OBD_PORT"),
+                                        batched=os.environ.get("OBD_BATCHED") == "1")
+    if connection is not None:
+        OBD2_setup()
+    else:
+        connector = VehicleConnector(os.environ.get("OBD_PORT"), os.environ.get("OBD_BATCHED") == "1")
+        connector.state.connect(mw.connectionState)
+        connector.connected.connect(mw.vehicleConnected)
+        connector.start()
     mw.setCursor(Qt.BlankCursor)
     mw.showFullScreen()
     sys.exit(app.exec_())
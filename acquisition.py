@@ -0,0 +1,276 @@
+import time
+import queue
+import atexit
+import struct
+import threading
+import collections
+import multiprocessing
+from multiprocessing import shared_memory
+import obd
+
+# Optional acquisition process for the cluster (OBD_ACQUISITION=process). The OBD connection, its serial
+# reads and the response parsing run in a child process that publishes every sample into a shared memory
+# ring, so neither side can hold up the other through the GIL. The GUI process reads the ring in place and
+# hands the samples to the usual callbacks, and restarts the child whenever it dies or the adapter wedges.
+
+HEADER = struct.Struct("<Q") #records written so far, only ever increased by the child
+STATUS = struct.Struct("<dddB7x") #child heartbeat, adapter latency and round trip, connection state
+RECORD = struct.Struct("<QddB7x") #record number + 1, time.monotonic() of the sample, value, channel
+STATUS_OFFSET = HEADER.size
+RECORDS_OFFSET = HEADER.size + STATUS.size
+CONNECTING, CONNECTED, FAILED = 0, 1, 2
+
+class SampleRing(object):
+    # single writer, single reader ring of samples. a record carries its own number, so the reader can
+    # tell a record that was overwritten while it read it from the one it expected
+    def __init__(self, name=None, capacity=4096):
+        self.capacity = capacity
+        size = RECORDS_OFFSET + RECORD.size * capacity
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.shm.buf[:size] = bytes(size)
+        else:
+            self.shm = shared_memory.SharedMemory(name) #a spawned child shares the creator's resource tracker
+        self.name = self.shm.name
+        self.buffer = self.shm.buf
+        self.written = HEADER.unpack_from(self.buffer, 0)[0] #a restarted child carries on numbering
+
+    def write(self, channel, stamp, value):
+        RECORD.pack_into(self.buffer, RECORDS_OFFSET + self.written % self.capacity * RECORD.size,
+                         self.written + 1, stamp, value, channel)
+        self.written += 1
+        HEADER.pack_into(self.buffer, 0, self.written) #publishes the record
+
+    def setStatus(self, heartbeat, latency, roundtrip, state):
+        STATUS.pack_into(self.buffer, STATUS_OFFSET, heartbeat, latency, roundtrip, state)
+
+    def status(self):
+        return STATUS.unpack_from(self.buffer, STATUS_OFFSET)
+
+    def read(self, position):
+        # (new position, [(channel, stamp, value)], records lost because the reader fell a whole ring behind)
+        written = HEADER.unpack_from(self.buffer, 0)[0]
+        lost = max(written - position - self.capacity, 0)
+        position += lost
+        rows = []
+        for index in range(position, written):
+            number, stamp, value, channel = RECORD.unpack_from(self.buffer, RECORDS_OFFSET +
+                                                               index % self.capacity * RECORD.size)
+            if number != index + 1:
+                break #overwritten meanwhile, the next read skips ahead
+            rows.append((channel, stamp, value))
+        return position + len(rows), rows, lost
+
+    def close(self, unlink=False):
+        self.buffer = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+def acquisitionMain(name, capacity, connector, portstr, watches, batched, units, control):
+    # runs in the child: connects, watches the commands and publishes their samples until told to stop
+    ring = SampleRing(name, capacity)
+    ring.setStatus(time.monotonic(), 0.0, 0.0, CONNECTING)
+    status = [None, CONNECTING] #the connection once connected, connection state
+    stopped = threading.Event()
+    def beat():
+        # the heartbeat has a thread of its own, so it keeps going while the main thread is busy connecting
+        # and only stops when the whole process is stuck
+        while not stopped.wait(0.5):
+            connection = status[0]
+            ring.setStatus(time.monotonic(), getattr(connection, "latency", 0.0),
+                           getattr(connection, "roundtrip", 0.0), status[1])
+    heartbeat = threading.Thread(target=beat, name="Heartbeat", daemon=True)
+    heartbeat.start()
+    connection = connector(portstr, fast=True, check_voltage=False, batched=batched)
+    if not connection.is_connected():
+        stopped.set()
+        heartbeat.join()
+        ring.setStatus(time.monotonic(), 0.0, 0.0, FAILED)
+        return
+    announced = set()
+    def publish(r, channel):
+        if r.value is None:
+            return
+        if channel not in announced:
+            units.put((channel, str(r.value.units)))
+            announced.add(channel)
+        ring.write(channel, time.monotonic(), float(r.value.magnitude))
+    for channel, (command, rate, priority) in enumerate(watches):
+        connection.watch(obd.commands[command], callback=lambda r, channel=channel: publish(r, channel),
+                         force=True, rate=rate, priority=priority)
+    connection.start()
+    status[:] = [connection, CONNECTED]
+    while True:
+        message = control.get()
+        if message[0] == "stop":
+            break
+        if message[0] == "throttle":
+            connection.throttle(*message[1:])
+    stopped.set()
+    heartbeat.join()
+    connection.close()
+    ring.close()
+
+class AcquisitionProcess(object):
+    # stands in for PIDScheduler in the GUI process, `connector` is the connection class the child runs
+    stalltimeout = 10.0 #seconds without a heartbeat, or without a sample once connected, before a restart
+    connecttimeout = 30.0 #seconds the child may take to connect, python-obd has no timeout of its own
+    pollinterval = 0.01 #seconds between reads of the ring
+    maxbackoff = 60.0 #longest wait between restarts while the adapter keeps failing
+
+    def __init__(self, connector, portstr=None, batched=False, capacity=4096):
+        self.connector = connector
+        self.portstr = portstr
+        self.batched = batched
+        self.context = multiprocessing.get_context("spawn") #forking a process running Qt threads isn't safe
+        self.ring = SampleRing(capacity=capacity)
+        self.watches = collections.OrderedDict() #key = command name, value = [rate, priority, callbacks]
+        self.responses = {} #key = command name, value = latest OBDResponse
+        self.units = {} #key = channel, value = parsed pint units
+        self.throttled = (1.0, 0)
+        self.process = None
+        self.control = None
+        self.unitqueue = None
+        self.thread = None
+        self.running = False
+        self.restarts = 0
+        self.lost = 0 #samples overwritten before they were read
+        self.closed = False
+        atexit.register(self.close) #the ring outlives the process unless it is unlinked
+
+    @property
+    def latency(self):
+        return self.ring.status()[1]
+
+    @property
+    def roundtrip(self):
+        return self.ring.status()[2]
+
+    def is_connected(self):
+        return self.ring.status()[3] == CONNECTED
+
+    def status(self):
+        return obd.OBDStatus.CAR_CONNECTED if self.is_connected() else obd.OBDStatus.NOT_CONNECTED
+
+    def watch(self, c, callback=None, force=False, rate=1.0, priority=0):
+        if c.name not in self.watches:
+            self.watches[c.name] = [rate, priority, []]
+            if self.process is not None:
+                self.spawn() #the child only learns its commands when it starts
+        if callback is not None and callback not in self.watches[c.name][2]:
+            self.watches[c.name][2].append(callback)
+
+    def unwatch(self, c, callback=None):
+        if c.name in self.watches:
+            if callback in self.watches[c.name][2]:
+                self.watches[c.name][2].remove(callback)
+            if callback is None or len(self.watches[c.name][2]) == 0:
+                self.watches.pop(c.name)
+
+    def unwatch_all(self):
+        self.watches = collections.OrderedDict()
+
+    def query(self, c, force=False):
+        return self.responses.get(c.name, obd.OBDResponse())
+
+    def throttle(self, scale, priority=0):
+        self.throttled = (scale, priority)
+        if self.control is not None:
+            self.control.put(("throttle", scale, priority))
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name="AcquisitionProcess")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.running = False
+            if self.thread is not threading.current_thread():
+                self.thread.join()
+            self.thread = None
+        self.terminate()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        self.stop()
+        self.ring.close(unlink=True)
+
+    def terminate(self):
+        if self.process is None:
+            return
+        try:
+            self.control.put(("stop",))
+        except (OSError, ValueError):
+            pass
+        self.process.join(2.0)
+        if self.process.is_alive():
+            self.process.kill() #wedged in a serial read
+            self.process.join(1.0)
+        self.process = None
+
+    def spawn(self):
+        self.terminate()
+        self.ring.setStatus(time.monotonic(), 0.0, 0.0, CONNECTING)
+        self.channels = list(self.watches.keys())
+        self.units = {}
+        self.control = self.context.Queue()
+        self.unitqueue = self.context.Queue()
+        watches = [(name, rate, priority) for name, (rate, priority, callbacks) in self.watches.items()]
+        self.process = self.context.Process(target=acquisitionMain, name="OBD acquisition", daemon=True,
+                                            args=(self.ring.name, self.ring.capacity, self.connector, self.portstr,
+                                                  watches, self.batched, self.unitqueue, self.control))
+        self.process.start()
+        if self.throttled != (1.0, 0):
+            self.control.put(("throttle",) + self.throttled)
+
+    def dispatch(self, channel, stamp, value):
+        while channel not in self.units:
+            # the child announces a channel's units before its first sample, the queue may just lag behind
+            announced, units = self.unitqueue.get(timeout=1.0)
+            self.units[announced] = obd.Unit.parse_units(units)
+        name = self.channels[channel]
+        r = obd.OBDResponse(obd.commands[name], [])
+        r.value = obd.Unit.Quantity(value, self.units[channel])
+        r.stamp = stamp #time.monotonic() in the child when the sample arrived, the clock is system wide
+        self.responses[name] = r
+        for callback in list(self.watches.get(name, [0, 0, []])[2]):
+            callback(r)
+
+    def run(self):
+        position = self.ring.written
+        backoff = 1.0
+        spawned = lastsample = 0.0
+        while self.running:
+            now = time.monotonic()
+            heartbeat, latency, roundtrip, state = self.ring.status()
+            alive = self.process is not None and self.process.is_alive()
+            # a stuck child process, a connect that never finishes, or an adapter that stopped answering
+            hung = alive and state != FAILED and (now - heartbeat > self.stalltimeout or
+                                                  (state == CONNECTING and now - spawned > self.connecttimeout) or
+                                                  (state == CONNECTED and now - lastsample > self.stalltimeout))
+            failed = (not alive or state == FAILED) and now - spawned > backoff
+            if self.process is None or hung or failed:
+                if self.process is not None:
+                    self.restarts += 1
+                    backoff = min(backoff * 2, self.maxbackoff)
+                self.spawn()
+                spawned = lastsample = time.monotonic()
+            position, rows, lost = self.ring.read(position)
+            self.lost += lost
+            try:
+                for channel, stamp, value in rows:
+                    self.dispatch(channel, stamp, value)
+            except queue.Empty:
+                pass #a child killed between announcing and sampling, the restart sorts it out
+            if rows:
+                lastsample = now
+                backoff = 1.0
+            time.sleep(self.pollinterval)
+        self.terminate()
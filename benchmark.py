@@ -0,0 +1,164 @@
+import os
+import sys
+import math
+import time
+import random
+import argparse
+
+# Headless rendering benchmark for the cluster: builds MainWindow on Qt's offscreen platform and drives
+# displayUpdate and the needle/speed animation frames with synthetic sample streams,
+# e.g.  python3 benchmark.py --frames 2000
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtWidgets import QApplication
+
+import OBD2_4 as cluster
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    def pick(p):
+        return ordered[min(int(p / 100.0 * len(ordered)), len(ordered) - 1)]
+    return pick(50), pick(90), pick(99), ordered[-1]
+
+def report(name, samples):
+    p50, p90, p99, worst = percentiles(samples)
+    print("{:<36}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}".format(name, p50 * 1000, p90 * 1000, p99 * 1000,
+                                                            worst * 1000))
+
+def cruise(i, rng):
+    return (195.0, 65.0 + rng.uniform(-0.6, 0.6), 2400.0 + rng.uniform(-40, 40), 1.0, 18.0)
+
+def sweep(i, rng):
+    phase = (i % 400) / 400.0
+    return (190.0 + phase * 10, phase * 120.0, 800.0 + phase * 6000.0, 0.9, 5.0 + phase * 60)
+
+def idle(i, rng):
+    return (200.0, 0.0, 780.0 + rng.uniform(-25, 25), 1.0, 3.2)
+
+STREAMS = {"cruise": cruise, "sweep": sweep, "idle": idle}
+
+def paint(app, widget):
+    widget.repaint()
+    app.processEvents()
+
+def timed(app, widget, func, frames):
+    samples = []
+    for i in range(frames):
+        start = time.perf_counter()
+        func(i)
+        paint(app, widget)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless MainWindow rendering benchmark")
+    parser.add_argument("--frames", type=int, default=1000, help="frames per measurement")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the synthetic streams")
+    parser.add_argument("--stream", choices=sorted(STREAMS), action="append",
+                        help="stream(s) to drive displayUpdate with, defaults to all of them")
+    args = parser.parse_args()
+
+    # displayUpdate saves the config and checkpoints the trip journal (and the synthetic fuel burn) whenever
+    # speed is zero
+    saved = {}
+    for name in ("config.txt", "trips.journal"):
+        if os.path.exists(cluster.filepath + name):
+            with open(cluster.filepath + name, "rb") as reader:
+                saved[name] = reader.read()
+
+    app = QApplication(sys.argv)
+    cluster.app = app
+    cluster.mw = mw = cluster.MainWindow()
+    mw.th.signal.disconnect() #only the benchmark drives displayUpdate
+    mw.Animation_Timer.timeout.disconnect() #and animationStep
+    mw.show()
+    paint(app, mw)
+    rng = random.Random(args.seed)
+
+    print("{:<36}{:>10}{:>10}{:>10}{:>10}".format("ms per call", "p50", "p90", "p99", "max"))
+    frame_costs = []
+    animation_costs = []
+    interval = 1.0 / mw.framerate
+    for name in args.stream or sorted(STREAMS):
+        stream = STREAMS[name]
+        # every frame carries a new MAF sample, so the fuel economy path runs each time
+        samples = timed(app, mw, lambda i: mw.displayUpdate(*stream(i, rng) + (mw.intervals + 1,)), args.frames)
+        frame_costs += samples
+        report("displayUpdate + paint ({})".format(name), samples)
+
+        # the needle and the speed readout are drawn by animationStep, one frame per animation timer interval
+        # chasing targets set from the same stream
+        def animate(i):
+            temp, speed, rpm, eqr, maf = stream(i, rng)
+            mw.needle.target = rpm / (mw.RPMlimit * 1000) * 270
+            mw.speedometer.target = speed
+            mw.lastframe = time.monotonic() - interval
+            mw.animationStep()
+        samples = timed(app, mw, animate, args.frames)
+        animation_costs += samples
+        report("animationStep + paint ({})".format(name), samples)
+
+    report("Speed_Label.setText", timed(app, mw, lambda i: mw.Speed_Label.setText(str(i % 150)), args.frames))
+    report("Temp_Display.display", timed(app, mw, lambda i: mw.Temp_Display.display(180 + i % 40), args.frames))
+    report("Eqr_Display.display", timed(app, mw, lambda i: mw.Eqr_Display.display(14.7 * (0.9 + i % 20 / 100.0)),
+                                        args.frames))
+    report("MPG_Display.display", timed(app, mw, lambda i: mw.MPG_Display.display(20 + i % 30), args.frames))
+    report("Range_Display.display", timed(app, mw, lambda i: mw.Range_Display.display(300 - i % 300),
+                                          args.frames))
+    report("Tach_Pointer.setRotation", timed(app, mw, lambda i: mw.Tach_Pointer.setRotation(
+        135 + 135 * math.sin(i / 20.0)), args.frames))
+    report("Time_Label.setText", timed(app, mw, lambda i: mw.Time_Label.setText("{}:{:02d}".format(
+        1 + i % 12, i % 60)), args.frames))
+
+    def retach(i):
+        mw.tachDestroy()
+        mw.tachSetup()
+    report("tachDestroy + tachSetup", timed(app, mw, retach, max(args.frames // 10, 1)))
+
+    sm = cluster.SettingsMenu()
+    sm.show()
+    shade = mw.shadeindex
+    report("SettingsMenu.changeBackgroundColor", timed(app, mw, lambda i: sm.changeBackgroundColor(i % 5),
+                                                       max(args.frames // 10, 1)))
+    sm.changeBackgroundColor(shade)
+    sm.hide()
+
+    # the sweep stream at 20 samples per second drawn by the data logger's graph, first with a minute of
+    # history as right after a boot, when the chart's span reaches back before the first sample, then with
+    # the whole five minutes
+    chart = cluster.StripChart(None)
+    chart.resize(698, 380)
+    chart.show()
+    for uptime in (60, 300):
+        cluster.hub.history = cluster.TimeSeriesStore(("temp", "speed", "rpm", "maf", "eqr"))
+        now = time.monotonic()
+        for i in range(uptime * 20):
+            temp, speed, rpm, eqr, maf = sweep(i, rng)
+            for name, value in (("temp", temp), ("speed", speed), ("rpm", rpm), ("eqr", eqr)):
+                cluster.hub.history.add(name, now - uptime + i * 0.05, value)
+        resolution, rows = cluster.hub.history.query("rpm", chart.span, time.monotonic(), chart.width())
+        report("StripChart paint ({} s, {} x {:g} s)".format(uptime, len(rows), resolution),
+               timed(app, chart, lambda i: None, max(args.frames // 10, 1)))
+    chart.hide()
+
+    p50, p90, p99, worst = percentiles(frame_costs)
+    a50, a90, a99, aworst = percentiles(animation_costs)
+    print("")
+    print("sustainable displayUpdate rate: {:.0f} Hz at p50, {:.0f} Hz at p99".format(1.0 / p50, 1.0 / p99))
+    # what is left of each second once the animation timer has drawn its frames
+    print("with the needle animating at {} fps: {:.0f}% of the GUI thread, {:.0f} Hz of displayUpdate left at p50,"
+          " {:.0f} Hz at p99".format(mw.framerate, mw.framerate * a50 * 100, max(1.0 - mw.framerate * a50, 0) / p50,
+                                    max(1.0 - mw.framerate * a99, 0) / p99))
+
+    mw.config.flush()
+    mw.journal.close()
+    for name in ("config.txt", "trips.journal"):
+        if name in saved:
+            with open(cluster.filepath + name, "wb") as writer:
+                writer.write(saved[name])
+        elif os.path.exists(cluster.filepath + name):
+            os.remove(cluster.filepath + name)
+
+if __name__ == '__main__':
+    main()
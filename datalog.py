@@ -0,0 +1,314 @@
+import os
+import sys
+import gzip
+import mmap
+import time
+import queue
+import struct
+import atexit
+import threading
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Data logging pipeline for the cluster. The GUI thread only formats rows and hands them to a queue,
+# a writer thread keeps the log open and writes them out in batches.
+#
+# Besides the CSV log there is a compact binary format: a header naming the channels followed by
+# fixed-width records of a float64 monotonic timestamp and one float32 per channel. Convert one to the
+# usual CSV layout with  python3 datalog.py export datalog.bin [datalog.csv]
+#
+# Logs are rotated into time stamped segments (datalog-20240131-174502-000.csv) by size and at the start of
+# every logging session. Closed segments are compressed by a low priority thread, and the oldest ones are
+# deleted once all segments together exceed the disk budget.
+
+FSYNC_POLICIES = ("never", "flush", "interval", "close")
+COMPRESSED = (".gz", ".zst")
+ROTATE = "rotate" #queue marker that closes the current segment
+
+CSV_HEADER = "Temp,Speed,RPM,MPG, Fuel Level\n"
+CSV_CHANNELS = ("temp", "speed", "rpm", "mpg", "fuel")
+
+BINARY_MAGIC = b"OBDLOG"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<6sHHdd") #magic, version, channel count, wall clock and monotonic start time
+BINARY_NAME = struct.Struct("16s")
+
+def packHeader(channels):
+    header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(channels), time.time(), time.monotonic())
+    return header + b"".join(BINARY_NAME.pack(name.encode("ascii")) for name in channels)
+
+def recordStruct(channels):
+    return struct.Struct("<d" + "f" * len(channels))
+
+def segments(path):
+    # closed segments of a log, oldest first since the time stamps and the zero padded count sort by name
+    directory, name = os.path.split(os.path.abspath(path))
+    stem = os.path.splitext(name)[0] + "-"
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                  if f.startswith(stem) and not f.endswith(".tmp"))
+
+def compressFile(path):
+    if zstandard is not None:
+        destination = path + ".zst"
+        opener = lambda f: zstandard.ZstdCompressor(level=3).stream_writer(f)
+    else:
+        destination = path + ".gz"
+        opener = lambda f: gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6)
+    with open(path, "rb") as reader, open(destination + ".tmp", "wb") as raw:
+        with opener(raw) as writer:
+            while True:
+                chunk = reader.read(65536)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                time.sleep(0.001) #hand the GIL back to the GUI between chunks
+    os.replace(destination + ".tmp", destination)
+    os.remove(path)
+
+def enforceBudget(path, budget):
+    # segments still waiting for SegmentCompressor are left out, each is counted by the check that follows
+    # its own compression instead of at its uncompressed size
+    closed = [f for f in segments(path) if f.endswith(COMPRESSED)]
+    total = sum(os.path.getsize(f) for f in closed)
+    if os.path.exists(path):
+        total += os.path.getsize(path)
+    while closed and total > budget:
+        oldest = closed.pop(0)
+        total -= os.path.getsize(oldest)
+        os.remove(oldest)
+
+class SegmentCompressor(threading.Thread):
+    def __init__(self):
+        super(SegmentCompressor, self).__init__(name="SegmentCompressor")
+        self.daemon = True
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+
+    def submit(self, segment, path, budget):
+        self.queue.put((segment, path, budget))
+        with self.lock:
+            if not self.is_alive():
+                self.start()
+
+    def run(self):
+        if sys.platform.startswith("linux"):
+            # Linux applies nice values per thread, so this leaves the GUI and the OBD threads alone
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            except OSError:
+                pass
+        while True:
+            segment, path, budget = self.queue.get()
+            try:
+                if segment is not None and not segment.endswith(COMPRESSED):
+                    compressFile(segment)
+                if budget is not None:
+                    enforceBudget(path, budget)
+            except OSError:
+                pass #a segment that can't be compressed now is picked up again when the next log starts
+
+compressor = SegmentCompressor()
+
+class LogWriter(threading.Thread):
+    mode = "a"
+
+    def __init__(self, path, header="", batchsize=64, flushinterval=2.0, fsync="interval", fsyncinterval=30.0,
+                 queuesize=4096, maxsize=16 * 1024 * 1024, budget=None, rotateonstart=True, previous=None):
+        super(LogWriter, self).__init__(name="LogWriter")
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("fsync policy must be one of {}".format(", ".join(FSYNC_POLICIES)))
+        self.daemon = True
+        self.path = path
+        self.header = header #written when the log is started from empty
+        self.batchsize = batchsize #rows collected before they are written out
+        self.flushinterval = flushinterval #seconds a row may wait in the batch
+        self.fsync = fsync
+        self.fsyncinterval = fsyncinterval
+        self.queue = queue.Queue(queuesize)
+        self.maxsize = maxsize #bytes after which the log is rotated, None never rotates by size
+        self.budget = budget #bytes the log and all of its segments may take up, None is unlimited
+        self.rotateonstart = rotateonstart #gives every logging session (trip) a segment of its own
+        self.previous = previous #writer of the session before, still flushing after close(wait=False)
+        self.dropped = 0 #rows lost because the queue was full, i.e. the storage stopped keeping up
+        self.closed = False
+        atexit.register(self.close)
+
+    def makeHeader(self):
+        return self.header
+
+    def rotate(self):
+        try:
+            self.queue.put_nowait(ROTATE)
+        except queue.Full:
+            pass
+
+    def write(self, row):
+        # never blocks, a stuck SD card costs rows instead of freezing the gauges
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, wait=True, timeout=5.0):
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        try:
+            self.queue.put_nowait(None) #wakes the writer up
+        except queue.Full:
+            pass #the writer notices self.closed once it has drained the queue
+        if wait and self.is_alive():
+            self.join(timeout)
+
+    def openLog(self):
+        writer = open(self.path, self.mode)
+        if writer.tell() == 0:
+            writer.write(self.makeHeader())
+        return writer
+
+    def closeSegment(self, writer):
+        writer.flush()
+        if self.fsync != "never":
+            os.fsync(writer.fileno())
+        writer.close()
+        if os.path.getsize(self.path) <= len(self.makeHeader()):
+            return #nothing but the header, keep using it
+        stem, ext = os.path.splitext(self.path)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        count = 0 #tells apart segments rotated within the same second
+        segment = "{}-{}-{:03d}{}".format(stem, stamp, count, ext)
+        while any(os.path.exists(segment + suffix) for suffix in ("",) + COMPRESSED):
+            count += 1
+            segment = "{}-{}-{:03d}{}".format(stem, stamp, count, ext)
+        os.rename(self.path, segment)
+        compressor.submit(segment, self.path, self.budget)
+
+    def run(self):
+        if self.previous is not None:
+            self.previous.join() #its final rows go into the log before it is rotated
+            self.previous = None
+        # segments left uncompressed by an earlier session, e.g. after a power cut
+        for segment in segments(self.path):
+            if not segment.endswith(COMPRESSED):
+                compressor.submit(segment, self.path, None)
+        if self.rotateonstart and os.path.exists(self.path):
+            with open(self.path, self.mode) as writer:
+                self.closeSegment(writer)
+        compressor.submit(None, self.path, self.budget)
+        writer = self.openLog()
+        batch = []
+        lastflush = lastsync = time.monotonic()
+        running = True
+        while running:
+            rotate = False
+            try:
+                row = self.queue.get(timeout=max(lastflush + self.flushinterval - time.monotonic(), 0.01))
+                if row is None:
+                    running = False
+                elif row is ROTATE:
+                    rotate = True
+                else:
+                    batch.append(row)
+            except queue.Empty:
+                running = not self.closed
+            now = time.monotonic()
+            if batch and (len(batch) >= self.batchsize or now - lastflush >= self.flushinterval or not running
+                          or rotate):
+                writer.write(batch[0][:0].join(batch))
+                writer.flush()
+                batch = []
+                if self.fsync == "flush" or (self.fsync == "interval" and now - lastsync >= self.fsyncinterval):
+                    os.fsync(writer.fileno())
+                    lastsync = now
+                if self.maxsize is not None and writer.tell() >= self.maxsize:
+                    rotate = True
+            if rotate and running:
+                self.closeSegment(writer)
+                writer = self.openLog()
+            if not batch:
+                lastflush = now
+        if self.fsync != "never":
+            os.fsync(writer.fileno())
+        writer.close()
+
+class BinaryLogWriter(LogWriter):
+    mode = "ab"
+
+    def __init__(self, path, channels, **kwargs):
+        self.channels = tuple(channels)
+        self.record = recordStruct(self.channels)
+        super(BinaryLogWriter, self).__init__(path, **kwargs)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            try:
+                existing = BinaryLog(path).channels
+            except (ValueError, struct.error):
+                existing = None
+            if existing != self.channels:
+                self.rotateonstart = True #records of a different layout can't be appended
+
+    def makeHeader(self):
+        return packHeader(self.channels)
+
+    def write(self, stamp, values):
+        super(BinaryLogWriter, self).write(self.record.pack(stamp, *values))
+
+class BinaryLog(object):
+    # read-only view of a binary log, records are unpacked straight out of a memory map
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as reader:
+            fields = BINARY_HEADER.unpack(reader.read(BINARY_HEADER.size))
+            if fields[0] != BINARY_MAGIC or fields[1] != BINARY_VERSION:
+                raise ValueError("{} is not a version {} binary log".format(path, BINARY_VERSION))
+            names = reader.read(BINARY_NAME.size * fields[2])
+        self.walltime, self.monotime = fields[3], fields[4]
+        self.channels = tuple(names[i:i + BINARY_NAME.size].rstrip(b"\0").decode("ascii")
+                              for i in range(0, len(names), BINARY_NAME.size))
+        self.record = recordStruct(self.channels)
+        self.offset = BINARY_HEADER.size + len(names)
+        # a record torn by a power cut is ignored
+        self.count = max(os.path.getsize(path) - self.offset, 0) // self.record.size
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        if self.count == 0:
+            return
+        with open(self.path, "rb") as reader:
+            with mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for i in range(self.count):
+                    yield self.record.unpack_from(data, self.offset + i * self.record.size)
+
+    def array(self):
+        # structured NumPy array backed by the file itself, field names are "time" plus the channel names
+        if numpy is None:
+            raise RuntimeError("NumPy is not installed")
+        dtype = numpy.dtype([("time", "<f8")] + [(name, "<f4") for name in self.channels])
+        if self.count == 0:
+            return numpy.zeros(0, dtype)
+        return numpy.memmap(self.path, dtype=dtype, mode="r", offset=self.offset, shape=(self.count,))
+
+def exportCSV(source, destination):
+    log = BinaryLog(source)
+    columns = [log.channels.index(name) + 1 for name in CSV_CHANNELS]
+    with open(destination, "w") as writer:
+        writer.write(CSV_HEADER)
+        for record in log:
+            # 7 significant digits is all a float32 holds, more would only print conversion noise
+            writer.write("{:.7g},{:.7g},{:.7g},{:.7g},{:.7g}\n".format(*[record[i] for i in columns]))
+    return len(log)
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4) or sys.argv[1] != "export":
+        print("usage: python3 datalog.py export <binary log> [csv file]")
+        sys.exit(1)
+    destination = sys.argv[3] if len(sys.argv) == 4 else os.path.splitext(sys.argv[2])[0] + ".csv"
+    print("{} rows written to {}".format(exportCSV(sys.argv[2], destination), destination))
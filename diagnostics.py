@@ -0,0 +1,88 @@
+import os
+import time
+
+# Always-on latency instrumentation for the cluster. Each stage of the path from an OBD response to the
+# painted gauge records its duration into a histogram of power of two buckets, which costs a couple of
+# additions per sample. Every histogram and counter is only written by one thread, so there are no locks;
+# a report that reads a histogram while it is being written may be off by the sample in flight.
+
+class Histogram(object):
+    buckets = 27 #bucket i counts durations below 2**i microseconds, the last one everything from ~33 s up
+
+    def __init__(self):
+        self.counts = [0] * self.buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[min(int(seconds * 1000000).bit_length(), self.buckets - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        # upper edge of the bucket holding the p-th percentile, in seconds
+        wanted = self.count * p / 100.0
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= wanted:
+                return min(2 ** i / 1000000.0, self.max)
+        return self.max
+
+class Instrumentation(object):
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = {} #key = stage name, value = Histogram, in the order the stages first reported
+        self.counters = {} #key = counter name, value = count
+        self.arrivals = {} #key = channel, value = [last arrival, moving average of the time between arrivals]
+
+    def record(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages.setdefault(stage, Histogram())
+        histogram.record(seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def sampled(self, channel, stamp):
+        arrival = self.arrivals.get(channel)
+        if arrival is None:
+            self.arrivals[channel] = [stamp, 0.0]
+        else:
+            interval = stamp - arrival[0]
+            arrival[1] = interval if arrival[1] == 0.0 else arrival[1] + 0.1 * (interval - arrival[1])
+            arrival[0] = stamp
+
+    def rates(self):
+        # achieved samples per second of every channel, 0 once a channel has gone quiet for 5 s
+        now = time.monotonic()
+        return {channel: (1.0 / interval if interval > 0 and now - last < 5.0 else 0.0)
+                for channel, (last, interval) in list(self.arrivals.items())}
+
+    def report(self, extra=None):
+        lines = ["uptime {:.0f} s".format(time.monotonic() - self.started), "",
+                 "{:<20}{:>9}{:>9}{:>9}{:>9}{:>9}".format("stage (ms)", "count", "mean", "p50", "p99", "max")]
+        for stage, histogram in list(self.stages.items()):
+            if histogram.count:
+                lines.append("{:<20}{:>9}{:>9.2f}{:>9.2f}{:>9.2f}{:>9.2f}".format(
+                    stage, histogram.count, histogram.total / histogram.count * 1000,
+                    histogram.percentile(50) * 1000, histogram.percentile(99) * 1000, histogram.max * 1000))
+        lines += ["", "samples per second"]
+        lines += ["  {:<18}{:>9.1f}".format(channel, rate) for channel, rate in sorted(self.rates().items())]
+        counters = dict(self.counters)
+        counters.update(extra or {})
+        lines += ["", "counters"]
+        lines += ["  {:<30}{}".format(name, value) for name, value in sorted(counters.items())]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path, extra=None):
+        with open(path + ".tmp", "w") as writer:
+            writer.write(time.strftime("%Y-%m-%d %H:%M:%S\n"))
+            writer.write(self.report(extra))
+        os.replace(path + ".tmp", path)
+
+instruments = Instrumentation()
@@ -0,0 +1,246 @@
+import os
+import sys
+import tty
+import time
+import math
+import random
+import select
+import argparse
+
+# Emulates an ELM327 adapter on a pseudo-terminal so python-obd (and the cluster) can connect to it the
+# same way it connects to /dev/rfcomm0, e.g.  OBD_PORT=/dev/pts/3 python3 OBD2_4.py
+# Only CAN 11 bit / 500 kbaud (protocol 6) is emulated, which is what python-obd's auto detection lands on.
+
+class Vehicle(object):
+    # a repeating 60 second drive cycle: pull away, cruise, brake to a stop, idle
+    def __init__(self):
+        self.start = time.monotonic()
+
+    def state(self):
+        elapsed = time.monotonic() - self.start
+        t = elapsed % 60.0
+        if t < 15:
+            speed = t * 6.0
+        elif t < 35:
+            speed = 90.0 + 5.0 * math.sin(t)
+        elif t < 50:
+            speed = max(90.0 - (t - 35) * 6.0, 0.0)
+        else:
+            speed = 0.0
+        gear_ratio = 45.0 if speed < 30 else 30.0 if speed < 60 else 25.0
+        rpm = max(800.0, speed * gear_ratio)
+        load = 20.0 + 60.0 * (t < 15) + 20.0 * (15 <= t < 35)
+        coolant = min(40.0 + elapsed / 3.0, 90.0) #warms up over the first couple of minutes
+        maf = rpm * load / 4000.0
+        eqr = 1.0 if load < 70 else 0.9
+        return speed, rpm, coolant, maf, eqr, load
+
+def encode_pid(pid, vehicle_state):
+    speed, rpm, coolant, maf, eqr, load = vehicle_state
+    if pid == 0x04:
+        return [int(load * 255 / 100)]
+    if pid == 0x05:
+        return [int(coolant + 40)]
+    if pid == 0x0C:
+        raw = int(rpm * 4)
+        return [raw >> 8 & 0xFF, raw & 0xFF]
+    if pid == 0x0D:
+        return [int(speed) & 0xFF]
+    if pid == 0x10:
+        raw = int(maf * 100)
+        return [raw >> 8 & 0xFF, raw & 0xFF]
+    if pid == 0x11:
+        return [int(min(load * 1.2, 100) * 255 / 100)]
+    if pid == 0x44:
+        raw = int(eqr * 32768)
+        return [raw >> 8 & 0xFF, raw & 0xFF]
+    return None
+
+SUPPORTED_PIDS = [0x04, 0x05, 0x0C, 0x0D, 0x10, 0x11, 0x44]
+
+def support_bitmap(base):
+    # PIDs 0x00, 0x20, 0x40... report which of the next 32 PIDs exist, the last bit chaining to the next range
+    bits = 0
+    for pid in SUPPORTED_PIDS + [p for p in range(0x20, 0xE0, 0x20) if p < max(SUPPORTED_PIDS)]:
+        if base < pid <= base + 0x20:
+            bits |= 1 << (0x20 - (pid - base))
+    return [bits >> 24 & 0xFF, bits >> 16 & 0xFF, bits >> 8 & 0xFF, bits & 0xFF]
+
+class ELM327Emulator(object):
+    def __init__(self, args):
+        self.args = args
+        self.vehicle = Vehicle()
+        self.random = random.Random(args.seed)
+        self.reset()
+        self.last_command = ""
+        self.commands = 0
+        self.requests = 0
+        self.errors = 0
+        self.delay_total = 0.0
+
+    def reset(self):
+        self.echo = True
+        self.headers = False
+        self.linefeeds = True
+        self.spaces = True
+
+    def handle(self, command):
+        command = command.replace(" ", "").upper()
+        if command == "":
+            command = self.last_command
+        self.last_command = command
+        if command.startswith("AT"):
+            return self.at_command(command[2:])
+        return self.obd_command(command)
+
+    def at_command(self, command):
+        if command == "Z":
+            self.reset()
+            return ["", "ELM327 v1.5"]
+        if command == "I":
+            return ["ELM327 v1.5"]
+        if command in ("E0", "E1"):
+            self.echo = command == "E1"
+        elif command in ("H0", "H1"):
+            self.headers = command == "H1"
+        elif command in ("L0", "L1"):
+            self.linefeeds = command == "L1"
+        elif command in ("S0", "S1"):
+            self.spaces = command == "S1"
+        elif command == "DPN":
+            return ["A6"]
+        elif command == "DP":
+            return ["AUTO, ISO 15765-4 (CAN 11/500)"]
+        elif command == "RV":
+            return ["{:.1f}V".format(self.args.voltage)]
+        elif not (command.startswith("SP") or command.startswith("TP") or command.startswith("SH")
+                  or command.startswith("ST") or command.startswith("AT") or command in ("D", "WS")):
+            return ["?"]
+        return ["OK"]
+
+    def obd_command(self, command):
+        try:
+            int(command, 16)
+        except ValueError:
+            return ["?"]
+        if len(command) % 2 == 1:
+            command = command[:-1] #python-obd's fast mode appends the expected number of response frames
+        if len(command) < 4 or command[:2] != "01":
+            return ["NO DATA"]
+        self.requests += 1
+        roll = self.random.random()
+        if roll < self.args.no_data_rate:
+            self.errors += 1
+            return ["NO DATA"]
+        roll -= self.args.no_data_rate
+        if roll < self.args.error_rate:
+            self.errors += 1
+            return ["CAN ERROR"]
+        pids = [int(command[i:i + 2], 16) for i in range(2, len(command), 2)]
+        if len(pids) > 6:
+            return ["?"]
+        state = self.vehicle.state()
+        data = [0x41]
+        for pid in pids:
+            if pid % 0x20 == 0:
+                payload = support_bitmap(pid)
+            else:
+                payload = encode_pid(pid, state)
+            if payload is None:
+                continue
+            if len(pids) > 1 and not self.args.multi_pid:
+                # ECUs without multi-PID support answer only the first PID of the request
+                data += [pid] + payload
+                break
+            data += [pid] + payload
+        if len(data) == 1:
+            return ["NO DATA"]
+        lines = self.frame(data)
+        roll = self.random.random()
+        if roll < self.args.garble_rate:
+            self.errors += 1
+            lines[-1] = lines[-1][:-3] #line noise cutting the last byte in half
+        return lines
+
+    def frame(self, data):
+        sep = " " if self.spaces else ""
+        def hexed(body):
+            return sep.join("{:02X}".format(b) for b in body)
+        if len(data) <= 7:
+            if self.headers:
+                return ["7E8" + sep + hexed([len(data)] + data)]
+            return [hexed(data)]
+        # ISO-TP first frame followed by consecutive frames
+        chunks = [data[:6]] + [data[i:i + 7] for i in range(6, len(data), 7)]
+        if self.headers:
+            frames = ["7E8" + sep + hexed([0x10 | (len(data) >> 8), len(data) & 0xFF] + chunks[0])]
+            for index, chunk in enumerate(chunks[1:]):
+                frames.append("7E8" + sep + hexed([0x20 | ((index + 1) & 0x0F)] + chunk))
+            return frames
+        # without headers the ELM prints the length followed by numbered lines
+        return ["{:03X}".format(len(data))] + ["{:X}:{}{}".format(index & 0x0F, sep, hexed(chunk))
+                                             for index, chunk in enumerate(chunks)]
+
+    def respond(self, command):
+        delay = self.args.delay + self.random.uniform(0, self.args.jitter)
+        if self.random.random() < self.args.stall_rate:
+            delay += self.args.stall_time
+        time.sleep(delay / 1000.0)
+        self.commands += 1
+        self.delay_total += delay
+        echo = self.echo
+        lines = self.handle(command)
+        eol = "\r\n" if self.linefeeds else "\r"
+        out = (command + eol) if echo else ""
+        out += eol.join(lines) + eol + eol + ">"
+        return out.encode()
+
+def main():
+    parser = argparse.ArgumentParser(description="ELM327 emulator on a pseudo-terminal")
+    parser.add_argument("--delay", type=float, default=40.0, help="base response delay in ms")
+    parser.add_argument("--jitter", type=float, default=20.0, help="extra random delay of up to this many ms")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="fraction of requests that stall")
+    parser.add_argument("--stall-time", type=float, default=2000.0, help="extra delay of a stalled request in ms")
+    parser.add_argument("--no-data-rate", type=float, default=0.0, help="fraction of requests answered NO DATA")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered CAN ERROR")
+    parser.add_argument("--garble-rate", type=float, default=0.0, help="fraction of responses cut short")
+    parser.add_argument("--no-multi-pid", dest="multi_pid", action="store_false",
+                        help="answer only the first PID of multi-PID requests")
+    parser.add_argument("--voltage", type=float, default=12.6, help="battery voltage reported to AT RV")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for jitter and errors")
+    parser.add_argument("--link", default=None, help="also create a symlink to the pty at this path")
+    args = parser.parse_args()
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    port = os.ttyname(slave)
+    if args.link:
+        if os.path.islink(args.link):
+            os.remove(args.link)
+        os.symlink(port, args.link)
+    print("ELM327 emulator listening on {}".format(port))
+    sys.stdout.flush()
+
+    emulator = ELM327Emulator(args)
+    buffer = b""
+    try:
+        while True:
+            readable, _, _ = select.select([master], [], [], 1.0)
+            if not readable:
+                continue
+            buffer += os.read(master, 1024)
+            while b"\r" in buffer:
+                command, buffer = buffer.split(b"\r", 1)
+                command = command.replace(b"\n", b"").decode("ascii", "replace")
+                os.write(master, emulator.respond(command))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+        if emulator.commands:
+            print("{} OBD requests, {} errors, {:.1f} ms average delay".format(
+                emulator.requests, emulator.errors, emulator.delay_total / emulator.commands))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import math
+import array
+import threading
+
+# Fixed memory history of the OBD channels for graphs. Every channel keeps its raw samples in a ring
+# and rolls them up into min/max/mean buckets at coarser resolutions, each in a ring of its own, so
+# "the last 10 minutes of coolant temperature" is read from the finest ring that still reaches back that
+# far instead of from raw samples, and memory stays the same however long the cluster runs.
+
+class Ring(object):
+    # parallel array backed columns, the oldest row is overwritten once the ring is full
+    def __init__(self, size, columns):
+        self.size = size
+        self.columns = [array.array("d", bytes(8 * size)) for i in range(columns)]
+        self.head = 0 #index the next row is written to
+        self.count = 0
+
+    def append(self, *row):
+        for column, value in zip(self.columns, row):
+            column[self.head] = value
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def oldest(self):
+        return self.columns[0][(self.head - self.count) % self.size] if self.count else math.inf
+
+    def spacing(self):
+        # average time between rows
+        if self.count < 2:
+            return 0.0
+        return (self.columns[0][(self.head - 1) % self.size] - self.oldest()) / (self.count - 1)
+
+    def since(self, start):
+        # rows whose first column is at or after start, oldest first. rows are appended in time order, so
+        # the first of them is found with a binary search over the ring
+        times = self.columns[0]
+        low, high = 0, self.count #logical indices, 0 is the oldest row
+        while low < high:
+            middle = (low + high) // 2
+            if times[(self.head - self.count + middle) % self.size] < start:
+                low = middle + 1
+            else:
+                high = middle
+        first = (self.head - self.count + low) % self.size
+        count = self.count - low
+        if first + count <= self.size:
+            columns = [column[first:first + count] for column in self.columns]
+        else:
+            columns = [column[first:] + column[:first + count - self.size] for column in self.columns]
+        return list(zip(*columns))
+
+class Rollup(object):
+    # min/max/mean of every `resolution` seconds, rows are (bucket start, min, max, mean)
+    def __init__(self, resolution, size):
+        self.resolution = resolution
+        self.ring = Ring(size, 4)
+        self.bucket = None #start time of the bucket being filled
+        self.low, self.high, self.total, self.count = 0.0, 0.0, 0.0, 0
+
+    def add(self, stamp, value):
+        bucket = stamp - stamp % self.resolution
+        if bucket != self.bucket:
+            self.close()
+            self.bucket = bucket
+            self.low, self.high, self.total, self.count = value, value, 0.0, 0
+        self.low = min(self.low, value)
+        self.high = max(self.high, value)
+        self.total += value
+        self.count += 1
+
+    def close(self):
+        if self.bucket is not None and self.count:
+            self.ring.append(self.bucket, self.low, self.high, self.total / self.count)
+
+    def current(self):
+        return (self.bucket, self.low, self.high, self.total / self.count) if self.count else None
+
+    def oldest(self):
+        # start of the oldest bucket, counting the one still being filled
+        if self.ring.count:
+            return self.ring.oldest()
+        return self.bucket if self.count else math.inf
+
+class Series(object):
+    def __init__(self, rawsize, levels):
+        self.raw = Ring(rawsize, 2) #(time, value)
+        self.rollups = [Rollup(resolution, size) for resolution, size in levels]
+        self.first = math.inf #time of the first sample ever added
+
+    def add(self, stamp, value):
+        self.first = min(self.first, stamp)
+        self.raw.append(stamp, value)
+        for rollup in self.rollups:
+            rollup.add(stamp, value)
+
+class TimeSeriesStore(object):
+    # default levels keep 1 s buckets for an hour and 1 min buckets for a day
+    def __init__(self, channels, rawsize=4096, levels=((1.0, 3600), (60.0, 1440))):
+        self.lock = threading.Lock()
+        self.series = {name: Series(rawsize, levels) for name in channels}
+
+    def add(self, name, stamp, value):
+        series = self.series.get(name)
+        if series is not None:
+            with self.lock:
+                series.add(stamp, value)
+
+    def query(self, name, span, now, points=600):
+        # returns (resolution, rows) for the last `span` seconds before `now` (time.monotonic()), 0 being raw.
+        # rows are (time, min, max, mean) from the finest resolution that holds everything since the start of
+        # the span, or since the first sample while the history is younger than the span, in about `points`
+        # rows or fewer, or from the one reaching back furthest when none does
+        start = now - span
+        series = self.series[name]
+        with self.lock:
+            held = max(start, series.first) #the span can't reach back further than the data does
+            levels = [None] + series.rollups
+            oldest = [series.raw.oldest()] + [rollup.oldest() for rollup in series.rollups]
+            resolutions = [series.raw.spacing()] + [rollup.resolution for rollup in series.rollups]
+            covering = [i for i in range(len(levels)) if oldest[i] <= held and resolutions[i] * points >= now - held]
+            level = levels[covering[0] if covering else oldest.index(min(oldest))]
+            if level is None:
+                return 0.0, [(t, v, v, v) for t, v in series.raw.since(start)]
+            rows = level.ring.since(start - level.resolution) #the bucket start may be before start
+            if level.current() is not None:
+                rows.append(level.current())
+            return level.resolution, rows
@@ -0,0 +1,137 @@
+import os
+import zlib
+import queue
+import struct
+import atexit
+import threading
+import collections
+
+# Crash safe trip and odometer journal for the cluster. Every record is a fixed size checkpoint of the running
+# totals followed by its CRC32, and records are only ever appended, so recovering after a power cut means
+# reading the last intact record at the end of the file however many drives the journal holds. A record
+# torn by the power cut fails its CRC and is cut off when the journal is opened again.
+
+JOURNAL_MAGIC = b"OBDTRIP"
+JOURNAL_VERSION = 1
+JOURNAL_HEADER = struct.Struct("<7sB") #magic, version
+RECORD = struct.Struct("<I8d") #trip number followed by the Checkpoint fields below it
+CRC = struct.Struct("<I")
+RECORD_SIZE = RECORD.size + CRC.size
+
+# distances in km, fuel in liters, engine time in seconds, fuellevel in the units the tank was set up in
+Checkpoint = collections.namedtuple("Checkpoint", ["trip", "time", "tripdistance", "tripfuel", "tripengine",
+                                                   "distance", "fuel", "engine", "fuellevel"])
+
+def packRecord(checkpoint):
+    record = RECORD.pack(*checkpoint)
+    return record + CRC.pack(zlib.crc32(record))
+
+def unpackRecord(data):
+    record, crc = data[:RECORD.size], CRC.unpack(data[RECORD.size:])[0]
+    if zlib.crc32(record) != crc:
+        return None
+    return Checkpoint(*RECORD.unpack(record))
+
+def readRecords(path):
+    # every intact checkpoint in the journal, oldest first
+    checkpoints = []
+    with open(path, "rb") as reader:
+        if not validHeader(reader.read(JOURNAL_HEADER.size)):
+            return checkpoints
+        while True:
+            data = reader.read(RECORD_SIZE)
+            if len(data) < RECORD_SIZE:
+                return checkpoints
+            checkpoint = unpackRecord(data)
+            if checkpoint is not None:
+                checkpoints.append(checkpoint)
+
+def validHeader(data):
+    return len(data) == JOURNAL_HEADER.size and JOURNAL_HEADER.unpack(data) == (JOURNAL_MAGIC, JOURNAL_VERSION)
+
+class TripJournal(threading.Thread):
+    maxrecords = 4096 #records after which the journal is compacted
+    keeptrips = 100 #trips whose final checkpoint survives a compaction
+
+    def __init__(self, path):
+        super(TripJournal, self).__init__(name="TripJournal")
+        self.daemon = True
+        self.path = path
+        self.queue = queue.Queue()
+        self.records = 0 #intact records up to and including the last one, where appending continues
+        self.last = self.recover()
+        self.closed = False
+        atexit.register(self.close)
+
+    def recover(self):
+        # walks back from the end of the file to the newest record whose CRC matches
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "rb") as reader:
+            if not validHeader(reader.read(JOURNAL_HEADER.size)):
+                return None
+            count = (os.path.getsize(self.path) - JOURNAL_HEADER.size) // RECORD_SIZE
+            for i in range(count - 1, -1, -1):
+                reader.seek(JOURNAL_HEADER.size + i * RECORD_SIZE)
+                checkpoint = unpackRecord(reader.read(RECORD_SIZE))
+                if checkpoint is not None:
+                    self.records = i + 1
+                    return checkpoint
+        return None
+
+    def checkpoint(self, checkpoint):
+        if not self.closed:
+            self.queue.put(checkpoint)
+
+    def close(self, wait=True, timeout=5.0):
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        self.queue.put(None)
+        if wait and self.is_alive():
+            self.join(timeout)
+
+    def openJournal(self):
+        if self.records == 0:
+            writer = open(self.path, "wb")
+            writer.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION))
+        else:
+            writer = open(self.path, "r+b")
+            writer.truncate(JOURNAL_HEADER.size + self.records * RECORD_SIZE) #drops a torn record
+            writer.seek(0, os.SEEK_END)
+        return writer
+
+    def compact(self):
+        # keeps the final checkpoint of the most recent trips, the newest record is always one of them
+        final = collections.OrderedDict()
+        for checkpoint in readRecords(self.path):
+            final.pop(checkpoint.trip, None)
+            final[checkpoint.trip] = checkpoint
+        kept = list(final.values())[-self.keeptrips:]
+        with open(self.path + ".tmp", "wb") as writer:
+            writer.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION))
+            writer.write(b"".join(packRecord(checkpoint) for checkpoint in kept))
+            writer.flush()
+            os.fsync(writer.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self.records = len(kept)
+
+    def run(self):
+        writer = self.openJournal()
+        while True:
+            checkpoint = self.queue.get()
+            if checkpoint is None:
+                break
+            try:
+                writer.write(packRecord(checkpoint))
+                writer.flush()
+                os.fsync(writer.fileno())
+                self.records += 1
+                if self.records > self.maxrecords:
+                    writer.close()
+                    self.compact()
+                    writer = self.openJournal()
+            except OSError:
+                pass #e.g. a full disk, the next checkpoint carries the same totals
+        writer.close()
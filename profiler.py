@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+import atexit
+import threading
+import collections
+import tracemalloc
+
+# Opt-in field profiler, started with OBD_PROFILE=1. A background thread samples the stack of every other
+# thread a few dozen times a second and counts which functions are running (self) or on the stack (total),
+# and tracemalloc snapshots are diffed against the previous report to show where memory keeps growing.
+# Reports are written next to config.txt as profile-20240131-174502.txt, only the newest few are kept.
+
+class SamplingProfiler(threading.Thread):
+    def __init__(self, directory, interval=0.02, period=300.0, keep=10, memory=True, top=25):
+        super(SamplingProfiler, self).__init__(name="SamplingProfiler")
+        self.daemon = True
+        self.directory = directory
+        self.interval = interval #seconds between stack samples
+        self.period = period #seconds between reports
+        self.keep = keep #reports kept on disk
+        self.memory = memory #track allocations with tracemalloc, which slows every allocation down a bit
+        self.top = top #functions and allocation sites listed per report
+        self.running = False
+        self.lock = threading.Lock()
+        self.reset()
+        self.snapshot = None
+
+    def reset(self):
+        self.samples = collections.Counter() #key = thread name, value = stacks sampled
+        self.own = collections.Counter() #key = (thread name, function), value = samples it was running in
+        self.total = collections.Counter() #key = (thread name, function), value = samples it was on the stack
+        self.started = time.monotonic()
+
+    def start(self):
+        if self.memory:
+            tracemalloc.start(1)
+            self.snapshot = tracemalloc.take_snapshot()
+        self.running = True
+        atexit.register(self.stop)
+        super(SamplingProfiler, self).start()
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            atexit.unregister(self.stop)
+            self.join(5.0)
+            self.writeReport()
+
+    def sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        me = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            thread = names.get(ident, "thread {}".format(ident))
+            seen = set()
+            function = None
+            while frame is not None:
+                code = frame.f_code
+                name = "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+                if function is None:
+                    function = name
+                if name not in seen: #recursion counts once
+                    seen.add(name)
+                    self.total[(thread, name)] += 1
+                frame = frame.f_back
+            self.own[(thread, function)] += 1
+            self.samples[thread] += 1
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        lines = ["sampling profile over {:.0f} s, one sample every {:.0f} ms".format(elapsed, self.interval * 1000)]
+        for thread, count in self.samples.most_common():
+            lines += ["", "thread {}: {} samples".format(thread, count),
+                      "{:>7} {:>7}  function".format("self%", "total%")]
+            functions = sorted((key[1] for key in self.total if key[0] == thread),
+                               key=lambda name: (-self.own[(thread, name)], -self.total[(thread, name)]))
+            for name in functions[:self.top]:
+                lines.append("{:>7.1f} {:>7.1f}  {}".format(self.own[(thread, name)] * 100.0 / count,
+                                                           self.total[(thread, name)] * 100.0 / count, name))
+        if self.memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                                                   tracemalloc.Filter(False, "<frozen importlib.*")))
+            current, peak = tracemalloc.get_traced_memory()
+            lines += ["", "traced memory {:.1f} KiB, peak {:.1f} KiB".format(current / 1024, peak / 1024),
+                      "allocation growth since the previous report:"]
+            if self.snapshot is not None:
+                for stat in snapshot.compare_to(self.snapshot, "lineno")[:self.top]:
+                    lines.append("  {}".format(stat))
+            self.snapshot = snapshot
+        return "\n".join(lines) + "\n"
+
+    def writeReport(self):
+        with self.lock:
+            text = self.report()
+            self.reset()
+        path = os.path.join(self.directory, "profile-{}.txt".format(time.strftime("%Y%m%d-%H%M%S")))
+        try:
+            with open(path + ".tmp", "w") as writer:
+                writer.write(text)
+            os.replace(path + ".tmp", path)
+            reports = sorted(f for f in os.listdir(self.directory) if f.startswith("profile-") and f.endswith(".txt"))
+            for old in reports[:-self.keep]:
+                os.remove(os.path.join(self.directory, old))
+        except OSError:
+            pass #e.g. a full disk, the next report tries again
+
+    def run(self):
+        if sys.platform.startswith("linux"):
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+            except OSError:
+                pass
+        due = time.monotonic() + self.period
+        while self.running:
+            time.sleep(self.interval)
+            with self.lock:
+                self.sample()
+            if time.monotonic() >= due:
+                due += self.period
+                self.writeReport()
@@ -0,0 +1,49 @@
+import unittest
+
+from history import TimeSeriesStore
+
+# Queries TimeSeriesStore the way the Data Logger's strip chart does, 20 Hz samples and a 5 minute span drawn
+# at the chart's width, including while the history is still younger than the span.
+
+RATE = 20.0
+SPAN = 300.0
+POINTS = 698
+
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        self.store = TimeSeriesStore(("rpm",))
+        self.first = 1000.0 #time.monotonic() of the first sample
+
+    def feed(self, since, until):
+        # samples from `since` to `until` seconds of uptime, returns the time at `until`
+        for i in range(int(since * RATE), int(until * RATE)):
+            self.store.add("rpm", self.first + i / RATE, 800.0 + i % 100)
+        return self.first + until
+
+    def test_span_longer_than_uptime(self):
+        fed = 0.0
+        for uptime in (30.0, 90.0, 200.0, 299.0):
+            now = self.feed(fed, uptime)
+            fed = uptime
+            resolution, rows = self.store.query("rpm", SPAN, now, POINTS)
+            self.assertLessEqual(resolution, 1.0, "uptime {}".format(uptime))
+            self.assertLessEqual(len(rows), POINTS)
+            self.assertLessEqual(rows[0][0], self.first + 1.0) #everything since the first sample
+            self.assertGreaterEqual(rows[-1][0], now - 1.0 - 1.0 / RATE)
+            self.assertGreater(len(rows), uptime / max(resolution, 1.0 / RATE) / 2)
+
+    def test_span_shorter_than_uptime(self):
+        now = self.feed(0.0, 600.0)
+        resolution, rows = self.store.query("rpm", SPAN, now, POINTS)
+        self.assertEqual(resolution, 1.0)
+        self.assertLessEqual(rows[0][0], now - SPAN)
+        self.assertGreaterEqual(rows[0][0], now - SPAN - 1.0)
+
+    def test_raw_while_it_fits(self):
+        now = self.feed(0.0, 20.0) #400 samples fit the chart as they are
+        resolution, rows = self.store.query("rpm", SPAN, now, POINTS)
+        self.assertEqual(resolution, 0.0)
+        self.assertEqual(len(rows), 400)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import re
+import sys
+import time
+import subprocess
+import unittest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+import obd
+import OBD2_4
+
+# Drives PIDScheduler against elm327_emulator.py: answering a share of the requests with NO DATA and CAN ERROR,
+# where the polling thread has to keep going and the null replies must never reach the callbacks, and on a
+# clean fast link, where every command has to reach its target rate right after the start.
+
+WATCHES = ((obd.commands.SPEED, 10.0, 2), (obd.commands.RPM, 20.0, 3), (obd.commands.MAF, 5.0, 1),
+           (obd.commands.COOLANT_TEMP, 0.5, 0), (obd.commands.COMMANDED_EQUIV_RATIO, 2.0, 1)) #as OBD2_setup
+
+class EmulatorTest(unittest.TestCase):
+    options = []
+
+    def setUp(self):
+        emulator = os.path.join(os.path.dirname(os.path.abspath(__file__)), "elm327_emulator.py")
+        self.emulator = subprocess.Popen([sys.executable, "-u", emulator, "--delay", "5", "--jitter", "2",
+                                          "--seed", "1"] + self.options,
+                                         stdout=subprocess.PIPE, universal_newlines=True)
+        self.port = re.search(r"/dev/\S+", self.emulator.stdout.readline()).group(0)
+        self.connection = OBD2_4.PIDScheduler(self.port, fast=True, check_voltage=False)
+
+    def tearDown(self):
+        self.connection.close()
+        self.emulator.kill()
+        self.emulator.wait()
+
+    def watchAll(self):
+        # key = command name, value = time.monotonic() of every sample
+        stamps = {command.name: [] for command, rate, priority in WATCHES}
+        for command, rate, priority in WATCHES:
+            self.connection.watch(command, callback=lambda r, name=command.name: stamps[name].append(time.monotonic()),
+                                  rate=rate, priority=priority)
+        return stamps
+
+class NullResponseTest(EmulatorTest):
+    options = ["--no-data-rate", "0.2", "--error-rate", "0.1"]
+
+    def test_polling_survives_null_replies(self):
+        self.assertTrue(self.connection.is_connected())
+        samples = []
+        self.connection.watch(obd.commands.RPM, callback=lambda r: samples.append(r.value.magnitude), rate=20.0,
+                              priority=3)
+        self.connection.watch(obd.commands.SPEED, callback=lambda r: samples.append(r.value.magnitude), rate=10.0,
+                              priority=2)
+        self.connection.start()
+        time.sleep(3.0)
+        self.assertTrue(self.connection.thread is not None and self.connection.thread.is_alive())
+        self.assertGreater(sum(sch.errors for sch in self.connection.schedules.values()), 0)
+        self.assertGreater(len(samples), 30)
+
+class RateTest(EmulatorTest):
+    def test_low_priority_reaches_target_rate(self):
+        # the first allocation plans with a guessed round trip far slower than the link, EQR has to speed up
+        # to its 2 Hz as soon as the measured round trip comes in rather than after the deadline it got first
+        stamps = self.watchAll()
+        started = time.monotonic()
+        self.connection.start()
+        time.sleep(3.0)
+        eqr = [stamp - started for stamp in stamps["COMMANDED_EQUIV_RATIO"]]
+        self.assertGreaterEqual(len([stamp for stamp in eqr if 1.0 <= stamp < 3.0]), 3)
+
+    def test_full_rate_right_after_throttle(self):
+        # the governor's "off" mode polls SPEED every 2 s, waking up must not wait for that deadline
+        stamps = self.watchAll()
+        self.connection.start()
+        time.sleep(1.0)
+        self.connection.throttle(0.05, 2)
+        time.sleep(2.5)
+        self.connection.throttle(1.0, 0)
+        woken = time.monotonic()
+        time.sleep(0.5)
+        self.assertGreaterEqual(len([stamp for stamp in stamps["SPEED"] if stamp >= woken]), 3)
+        self.assertGreaterEqual(len([stamp for stamp in stamps["RPM"] if stamp >= woken]), 5)
+
+if __name__ == "__main__":
+    unittest.main()
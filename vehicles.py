@@ -0,0 +1,68 @@
+import os
+import collections
+
+# Cache of how each vehicle was last reached, so a boot can skip the adapter's port scan, baud rate and
+# protocol search and the supported PID probing. A vehicle is told apart by its protocol and its answer to
+# PIDS_A (0100), which has to be asked anyway to confirm the car is there. Stored as versioned lines of
+# space separated key=value fields next to config.txt, the most recently connected vehicle last.
+
+PROFILES_VERSION = 1
+
+# bitmaps: key = PID getter name (PIDS_A, PIDS_B, ...), value = its 32 support bits, PID getter + 1 first
+Profile = collections.namedtuple("Profile", ["fingerprint", "port", "baudrate", "protocol", "bitmaps"])
+
+def fingerprint(protocol, pidsa):
+    return "{}-{:08X}".format(protocol, pidsa)
+
+class VehicleProfiles(object):
+    keep = 20 #vehicles remembered, the ones connected to longest ago are forgotten first
+
+    def __init__(self, path):
+        self.path = path
+        self.profiles = collections.OrderedDict() #key = fingerprint, value = Profile
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as reader:
+                lines = reader.read().splitlines()
+        except OSError:
+            return
+        if len(lines) == 0 or lines[0].strip() != "version={}".format(PROFILES_VERSION):
+            return #an unknown format only costs one slow connect
+        for line in lines[1:]:
+            fields = dict(field.split("=", 1) for field in line.split() if "=" in field)
+            try:
+                bitmaps = {name: int(fields[name], 16) for name in fields if name.startswith(("PIDS_", "MIDS_"))}
+                profile = Profile(fields["vehicle"], fields["port"], int(fields["baudrate"]), fields["protocol"],
+                                  bitmaps)
+            except (KeyError, ValueError):
+                continue #a damaged line loses that vehicle only
+            self.profiles[profile.fingerprint] = profile
+
+    def get(self, fingerprint):
+        return self.profiles.get(fingerprint)
+
+    def last(self):
+        return next(reversed(self.profiles.values()), None)
+
+    def remember(self, profile):
+        self.profiles.pop(profile.fingerprint, None)
+        self.profiles[profile.fingerprint] = profile
+        while len(self.profiles) > self.keep:
+            self.profiles.popitem(last=False)
+        self.save()
+
+    def save(self):
+        lines = ["version={}".format(PROFILES_VERSION)]
+        for profile in self.profiles.values():
+            fields = ["vehicle=" + profile.fingerprint, "port=" + profile.port,
+                      "baudrate={}".format(profile.baudrate), "protocol=" + profile.protocol]
+            fields += ["{}={:08X}".format(name, bits) for name, bits in sorted(profile.bitmaps.items())]
+            lines.append(" ".join(fields))
+        try:
+            with open(self.path + ".tmp", "w") as writer:
+                writer.write("\n".join(lines) + "\n")
+            os.replace(self.path + ".tmp", self.path)
+        except OSError:
+            pass #e.g. a read only card, the next boot probes again